@@ -0,0 +1,144 @@
+from datetime import datetime
+from bson.objectid import ObjectId
+from mongo_api import Notification, Task, TASK_FIELDS, TASKS_PAGE_SIZE, TASK_PAGE_PROJECTION, _page_query, _page_result, _day_query, _month_pipeline
+import task_cache
+from connections import Lazy, async_mongo_collection
+from redis_api import REDIS_TIMERS_REMINDERS, REDIS_TIMERS_DEADLINES, async_schedule_timer, async_unschedule_timer, async_unschedule_timers
+
+# Same collections as mongo_api, but on the asyncio driver so the bot's event loop never blocks
+tasks_collection = Lazy(lambda: async_mongo_collection("tasks"))
+notifications_collection = Lazy(lambda: async_mongo_collection("notifications"))
+
+
+class AsyncNotification(Notification):
+    """Notification with awaitable database methods, for use inside handlers."""
+
+    __slots__ = ()
+
+    async def insert(self):
+        result = await notifications_collection.insert_one({
+            "_task_id": ObjectId(self._task_id),
+            "user_id": self.user_id,
+            "next": self.next,
+            "period_sec": self.period.total_seconds(),
+            "times_left": self.times_left,
+        })
+
+        self._id = result.inserted_id
+        await async_schedule_timer(REDIS_TIMERS_REMINDERS, self._id, self.next)
+
+    async def delete(self):
+        await notifications_collection.delete_one({"_id": ObjectId(self._id)})
+        await async_unschedule_timer(REDIS_TIMERS_REMINDERS, self._id)
+
+    async def commit(self):
+        await notifications_collection.update_one({"_id": ObjectId(self._id)}, {"$set": {
+            "next": self.next,
+            "period_sec": self.period.total_seconds(),
+            "times_left": self.times_left,
+        }})
+        await async_schedule_timer(REDIS_TIMERS_REMINDERS, self._id, self.next)
+
+
+class AsyncTask(Task):
+    """Task with awaitable database methods, for use inside handlers."""
+
+    __slots__ = ()
+
+    async def commit(self, fields: tuple = TASK_FIELDS):
+        await tasks_collection.update_one({"_id": ObjectId(self._id)}, {"$set": {field: getattr(self, field) for field in fields}})
+        await task_cache.async_invalidate([self._id], [self.user_id])
+
+        if "deadline" not in fields and "was_longen" not in fields:
+            return
+        if self.was_longen:
+            await async_unschedule_timer(REDIS_TIMERS_DEADLINES, self._id)
+        else:
+            await async_schedule_timer(REDIS_TIMERS_DEADLINES, self._id, self.deadline)
+
+    async def insert(self):
+        result = await tasks_collection.insert_one({
+            "user_id": self.user_id,
+            "title": self.title,
+            "description": self.description,
+            "deadline": self.deadline,
+            "was_longen": False,
+        })
+
+        self._id = result.inserted_id
+        await task_cache.async_invalidate([self._id], [self.user_id])
+        await async_schedule_timer(REDIS_TIMERS_DEADLINES, self._id, self.deadline)
+
+    async def get_all_by_day(target_day: datetime, user_id: int) -> list:
+        query = tasks_collection.find(_day_query(target_day, user_id))
+        return [AsyncTask.from_doc(task) async for task in query]
+
+    async def get_month_counts(user_id: int, year: int, month: int) -> dict:
+        key = task_cache.calendar_key(user_id)
+        months = task_cache.get(key) or {}
+        counts = months.get((year, month))
+        if counts == None:
+            version = task_cache.version()
+            query = await tasks_collection.aggregate(_month_pipeline(user_id, year, month))
+            counts = {day["_id"]: day["count"] async for day in query}
+            task_cache.put(key, {**months, (year, month): counts}, version)
+
+        return counts
+
+    async def delete_all_by_day(target_day: datetime, user_id: int) -> int:
+        return await AsyncTask.delete_where(_day_query(target_day, user_id))
+
+    async def delete_by_ids(ids: list, user_id: int) -> int:
+        return await AsyncTask.delete_where({"_id": {"$in": [ObjectId(_id) for _id in ids]}, "user_id": user_id})
+
+    async def delete_where(query: dict) -> int:
+        tasks = await tasks_collection.find(query, {"user_id": 1}).to_list()
+        if not tasks:
+            return 0
+
+        ids = [task["_id"] for task in tasks]
+        await tasks_collection.delete_many({"_id": {"$in": ids}})
+        await notifications_collection.delete_many({"_task_id": {"$in": ids}})
+        await task_cache.async_invalidate(ids, [task["user_id"] for task in tasks])
+        await async_unschedule_timers(REDIS_TIMERS_DEADLINES, ids)
+        return len(ids)
+
+    async def get_page_by_user(user_id: int, after: tuple = None, before: tuple = None, limit: int = TASKS_PAGE_SIZE):
+        query, sort = _page_query(user_id, after, before)
+        docs = await tasks_collection.find(query, TASK_PAGE_PROJECTION).sort(sort).limit(limit + 1).to_list()
+        return _page_result(AsyncTask, docs, after, before, limit)
+
+    async def get_all_by_user(user_id: int) -> list:
+        key = task_cache.user_key(user_id)
+        query = task_cache.get(key)
+        if query == None:
+            version = task_cache.version()
+            query = await tasks_collection.find({"user_id": user_id}).to_list()
+            task_cache.put(key, query, version)
+
+        return [AsyncTask.from_doc(task) for task in query]
+
+    async def get_task_by_id(_task_id: str):
+        key = task_cache.task_key(_task_id)
+        query = task_cache.get(key)
+        if query == None:
+            version = task_cache.version()
+            query = await tasks_collection.find_one({"_id": ObjectId(_task_id)})
+            if(query == None):
+                return None
+            task_cache.put(key, query, version)
+
+        return AsyncTask.from_doc(query)
+
+    async def get_by_ids(ids: list) -> list:
+        if not ids:
+            return list()
+
+        query = tasks_collection.find({"_id": {"$in": [ObjectId(_id) for _id in ids]}})
+        return [AsyncTask.from_doc(task) async for task in query]
+
+    async def delete(self):
+        await tasks_collection.delete_one({"_id": ObjectId(self._id)})
+        await notifications_collection.delete_many({"_task_id": ObjectId(self._id)})
+        await task_cache.async_invalidate([self._id], [self.user_id])
+        await async_unschedule_timer(REDIS_TIMERS_DEADLINES, self._id)
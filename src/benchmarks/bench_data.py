@@ -0,0 +1,146 @@
+"""Benchmarks for the data layer and the notifier's hot paths.
+
+Seeds the local Mongo and Redis from docker-compose.yml, in the pybot_bench database and
+Redis db 15 so the bot's own data is left alone, then times each hot path per volume and
+prints the results as JSON. Run from src/:
+
+    python -m benchmarks.bench_data --sizes 1000 10000 100000 1000000 --output bench.json
+
+Compare two commits by running it on each and diffing the files.
+"""
+import os
+
+# Must be set before connections is imported
+os.environ.setdefault("MONGO_DB", "pybot_bench")
+os.environ.setdefault("REDIS_DB", "15")
+
+import argparse
+import contextlib
+import json
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+from bson.objectid import ObjectId
+
+import notifier
+import payload
+import task_cache
+from connections import MONGO_DB
+from mongo_api import Notification, Task, ensure_indexes, rebuild_timers, tasks_collection, notifications_collection
+from redis_api import r, REDIS_QUEUE_REMINDERS
+
+USERS = 1000
+# Share of tasks and notifications that are due when the notifier tick runs
+DUE_SHARE = 0.01
+SEED_BATCH = 10000
+QUEUE_MESSAGES = 10000
+
+
+def seed(size: int, now: datetime):
+    tasks_collection.drop()
+    notifications_collection.drop()
+    r.flushdb()
+    ensure_indexes()
+
+    due_every = int(1 / DUE_SHARE)
+    for start in range(0, size, SEED_BATCH):
+        tasks = list()
+        notifications = list()
+        for i in range(start, min(start + SEED_BATCH, size)):
+            due = i % due_every == 0
+            deadline = now - timedelta(minutes=1) if due else now + timedelta(minutes=i % 100000)
+            task_id = ObjectId()
+            tasks.append({"_id": task_id, "user_id": i % USERS, "title": f"task {i}", "description": "description " * 5,
+                          "deadline": deadline, "was_longen": False})
+            notifications.append({"_task_id": task_id, "user_id": i % USERS, "next": deadline,
+                                  "period_sec": 3600.0, "times_left": 3})
+        tasks_collection.insert_many(tasks, ordered=False)
+        notifications_collection.insert_many(notifications, ordered=False)
+
+
+def timed(function, repeat: int) -> dict:
+    runs = list()
+    for _ in range(repeat):
+        task_cache.cache.entries.clear()  # measure the database, not the cache
+        started = time.perf_counter()
+        function()
+        runs.append(time.perf_counter() - started)
+
+    return {"median_s": statistics.median(runs), "min_s": min(runs), "runs": len(runs)}
+
+
+def bench_queue_push() -> dict:
+    message = payload.encode(payload.EVENT_REMINDER, ObjectId(), datetime.now())
+    started = time.perf_counter()
+    with r.pipeline(transaction=False) as pipe:
+        pipe.rpush(REDIS_QUEUE_REMINDERS, *([message] * QUEUE_MESSAGES))
+        pipe.execute()
+    elapsed = time.perf_counter() - started
+    r.delete(REDIS_QUEUE_REMINDERS)
+
+    return {"median_s": elapsed, "min_s": elapsed, "runs": 1, "messages_per_s": round(QUEUE_MESSAGES / elapsed)}
+
+
+def run(size: int, repeat: int) -> list:
+    now = datetime.now()
+    seed_started = time.perf_counter()
+    seed(size, now)
+    print(f"seeded {size} tasks and notifications in {time.perf_counter() - seed_started:.1f}s")
+
+    results = {
+        "Notification.get_all": timed(Notification.get_all, repeat),
+        "Task.get_all_by_user": timed(lambda: Task.get_all_by_user(1), repeat),
+        "Task.get_all_by_day": timed(lambda: Task.get_all_by_day(now + timedelta(days=1), 1), repeat),
+        "Task.get_month_counts": timed(lambda: Task.get_month_counts(1, now.year, now.month), repeat),
+        "Task.get_page_by_user": timed(lambda: Task.get_page_by_user(1), repeat),
+        "rebuild_timers": timed(rebuild_timers, 1),
+        # Runs once: the tick claims the due items, so a second run would find nothing
+        "notifier tick": timed(lambda: notifier.process_due(datetime.now(), notifier.claim_due_from_timers), 1),
+        "queue push": bench_queue_push(),
+    }
+
+    return [{"benchmark": name, "size": size, **result} for name, result in results.items()]
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="file to write the JSON report to, stdout if omitted")
+    args = parser.parse_args()
+
+    # Seeding drops the collections and flushes the Redis db. REDIS_URL overrides REDIS_DB,
+    # so check the db the client actually connects to
+    if MONGO_DB == "pybot" or (r.connection_pool.connection_kwargs.get("db") or 0) == 0:
+        parser.error("refusing to run against the bot's own database, unset MONGO_DB and REDIS_DB, or point REDIS_URL at another db")
+
+    # Progress and the notifier's tick log go to stderr, so stdout holds only the report
+    results = list()
+    with contextlib.redirect_stdout(sys.stderr):
+        for size in args.sizes:
+            results.extend(run(size, args.repeat))
+
+        tasks_collection.drop()
+        notifications_collection.drop()
+        r.flushdb()
+
+    report = json.dumps({"commit": git_commit(), "date": datetime.now().isoformat(), "results": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(report)
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
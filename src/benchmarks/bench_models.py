@@ -0,0 +1,90 @@
+"""Per-object cost of decoding task and notification documents.
+
+Compares the previous plain-class construction with the slotted models and their
+shared from_doc decoder. Needs no database. Run from src/:
+
+    python -m benchmarks.bench_models [count]
+"""
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from bson.objectid import ObjectId
+
+from mongo_api import Notification, Task
+
+
+class LegacyTask:
+    """Task as it was before __slots__, built the way the query methods used to build it."""
+
+    def __init__(self, user_id, title, description, deadline, _id=None, wasLongen = False,):
+        self.user_id = user_id
+        self.title = title
+        self.description = description
+        self.deadline = deadline
+        self.was_longen = wasLongen
+
+        if(_id != None):
+            self._id = _id
+
+
+class LegacyNotification:
+    def __init__(self, next: datetime, period: timedelta, timesLeft: int, _task_id: str, _id: str):
+        self.next = next
+        self.period = period
+        self.times_left = timesLeft
+        self._id = _id
+        self._task_id = _task_id
+
+
+def legacy_task(task: dict):
+    return LegacyTask(task["user_id"], task["title"], task["description"], task["deadline"], task["_id"], task["was_longen"])
+
+
+def legacy_notification(notification: dict):
+    return LegacyNotification(next=notification["next"], period=timedelta(seconds=notification["period_sec"]), timesLeft=notification["times_left"], _task_id=notification["_task_id"], _id=notification["_id"])
+
+
+def make_docs(count: int):
+    now = datetime.now()
+    tasks = [{"_id": ObjectId(), "user_id": i % 1000, "title": f"task {i}", "description": "description " * 5,
+              "deadline": now + timedelta(minutes=i), "was_longen": False} for i in range(count)]
+    notifications = [{"_id": ObjectId(), "_task_id": task["_id"], "user_id": task["user_id"], "next": task["deadline"],
+                      "period_sec": 3600.0, "times_left": 3} for task in tasks]
+    return tasks, notifications
+
+
+def measure(decode, docs: list) -> dict:
+    started = time.perf_counter()
+    for doc in docs:
+        decode(doc)
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    kept = [decode(doc) for doc in docs]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+
+    return {"ns_per_object": round(elapsed / len(docs) * 1e9), "bytes_per_object": round(size / len(docs))}
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    tasks, notifications = make_docs(count)
+
+    results = {
+        "Task (legacy)": measure(legacy_task, tasks),
+        "Task.from_doc": measure(Task.from_doc, tasks),
+        "Notification (legacy)": measure(legacy_notification, notifications),
+        "Notification.from_doc": measure(Notification.from_doc, notifications),
+    }
+
+    print(f"{count} documents each")
+    for name, result in results.items():
+        print(f"{name:<24} {result['ns_per_object']:>6} ns/object {result['bytes_per_object']:>6} bytes/object")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,14 @@
+import sys
+
+from mongo_api import ensure_indexes, check_indexes
+
+# Fails with a non-zero exit code if any mongo_api query falls back to COLLSCAN
+if __name__ == "__main__":
+    ensure_indexes()
+    try:
+        check_indexes()
+    except RuntimeError as e:
+        print(e)
+        sys.exit(1)
+
+    print("all queries use an index")
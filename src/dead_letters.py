@@ -0,0 +1,116 @@
+"""Inspects the reliable queue or streams: what is waiting, in flight, retried and dead-lettered.
+
+    python dead_letters.py stats
+    python dead_letters.py list --limit 20
+    python dead_letters.py requeue --count 10
+    python dead_letters.py purge
+"""
+import argparse
+import base64
+import json
+from datetime import datetime
+
+import redis.exceptions
+
+from redis_api import r, QUEUE_MODE, REDIS_QUEUE_REMINDERS, REDIS_QUEUE_DEADLINES, REDIS_QUEUE_RETRY, REDIS_QUEUE_DEAD
+from reliable_queue import REDIS_QUEUE_CONSUMERS, processing_key, heartbeat_key
+from stream_queue import group_info, stream_key, add_messages
+import payload
+
+
+def stream_stats():
+    for queue in (REDIS_QUEUE_REMINDERS, REDIS_QUEUE_DEADLINES):
+        info = group_info(r, queue)
+        print(f"{stream_key(queue)}: {info['length']} entries, {info['lag']} unread, {info['pending']} pending")
+        for consumer in info["consumers"]:
+            name = consumer["name"].decode('utf-8') if isinstance(consumer["name"], bytes) else consumer["name"]
+            print(f"    consumer {name}: {consumer['pending']} pending, idle {consumer['idle'] / 1000:.0f}s")
+
+
+def stats():
+    if QUEUE_MODE == "stream":
+        stream_stats()
+        print(f"dead: {r.llen(REDIS_QUEUE_DEAD)}")
+        return
+
+    for queue in (REDIS_QUEUE_REMINDERS, REDIS_QUEUE_DEADLINES):
+        print(f"{queue}: {r.llen(queue)} waiting")
+
+    for member in r.smembers(REDIS_QUEUE_CONSUMERS):
+        consumer_id = member.decode('utf-8')
+        state = "alive" if r.exists(heartbeat_key(consumer_id)) else "silent"
+        in_flight = sum(r.llen(processing_key(consumer_id, queue)) for queue in (REDIS_QUEUE_REMINDERS, REDIS_QUEUE_DEADLINES))
+        print(f"consumer {consumer_id} ({state}): {in_flight} in flight")
+
+    print(f"retry: {r.zcard(REDIS_QUEUE_RETRY)} scheduled")
+    print(f"dead: {r.llen(REDIS_QUEUE_DEAD)}")
+
+
+def list_dead(limit: int):
+    for entry in r.lrange(REDIS_QUEUE_DEAD, 0, limit - 1):
+        decoded = json.loads(entry)
+        failed_at = datetime.fromtimestamp(decoded["failed_at"]).isoformat(sep=" ", timespec="seconds")
+        print(f"{failed_at} {decoded['queue']} attempts={decoded['attempts']} error={decoded['error']}")
+        print(f"    {payload.describe(base64.b64decode(decoded['message']))}")
+
+
+def _requeue_oldest(pipe) -> bool:
+    # Watched, so the oldest dead letter moves back to its queue exactly once
+    pipe.watch(REDIS_QUEUE_DEAD)
+    entry = pipe.lindex(REDIS_QUEUE_DEAD, -1)
+    if entry == None:
+        return False
+
+    decoded = json.loads(entry)
+    message = base64.b64decode(decoded["message"])
+    pipe.multi()
+    pipe.rpop(REDIS_QUEUE_DEAD)
+    if QUEUE_MODE == "stream":
+        add_messages(pipe, decoded["queue"], [message])
+    else:
+        pipe.rpush(decoded["queue"], message)
+    pipe.execute()
+    return True
+
+
+def requeue(count: int):
+    moved = 0
+    with r.pipeline() as pipe:
+        while count == None or moved < count:
+            try:
+                if not _requeue_oldest(pipe):
+                    break
+                moved += 1
+            except redis.exceptions.WatchError:
+                pass
+            finally:
+                pipe.reset()
+
+    print(f"requeued {moved} messages")
+
+
+def purge():
+    dead = r.llen(REDIS_QUEUE_DEAD)
+    r.delete(REDIS_QUEUE_DEAD)
+    print(f"purged {dead} messages")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("stats", help="queue depths, consumers and their unacked messages")
+    list_parser = commands.add_parser("list", help="newest dead letters first")
+    list_parser.add_argument("--limit", type=int, default=20)
+    requeue_parser = commands.add_parser("requeue", help="send the oldest dead letters again, all by default")
+    requeue_parser.add_argument("--count", type=int)
+    commands.add_parser("purge", help="drop every dead letter")
+    args = parser.parse_args()
+
+    if args.command == "stats":
+        stats()
+    elif args.command == "list":
+        list_dead(args.limit)
+    elif args.command == "requeue":
+        requeue(args.count)
+    else:
+        purge()
@@ -0,0 +1,100 @@
+import asyncio
+import os
+import re
+
+from aiogram import html
+
+# Reminders and deadline notices for one user arriving within this many seconds go out as one message
+DIGEST_WINDOW = float(os.environ.get("DIGEST_WINDOW", "2"))
+# Telegram rejects longer messages, counted after HTML parsing
+MAX_MESSAGE_LENGTH = 4096
+# Messages held for digesting at once; beyond that the consumer waits, so a backlog stays in Redis
+DIGEST_MAX_PENDING = 1000
+
+# A tag, an entity or one visible character of a rendered message
+_HTML_TOKEN = re.compile(r"<(/?)(\w+)[^>]*>|&[#\w]+;|.", re.DOTALL)
+
+
+def truncate(text: str, limit: int = MAX_MESSAGE_LENGTH) -> str:
+    """Cuts text to limit visible characters, closing the tags left open at the cut."""
+    visible = 0
+    open_tags = list()
+    for token in _HTML_TOKEN.finditer(text):
+        if token.group(2) == None:
+            visible += 1
+            if visible == limit and token.end() < len(text):
+                return text[:token.start()] + "…" + "".join(f"</{tag}>" for tag in reversed(open_tags))
+        elif token.group(1):
+            if open_tags and open_tags[-1] == token.group(2):
+                open_tags.pop()
+        else:
+            open_tags.append(token.group(2))
+
+    return text
+
+
+class Digester:
+    """Coalesces messages per chat over a short window before passing them to notificator.
+    Has the same send_message signature as Bot, so it can sit in front of a Sender."""
+
+    def __init__(self, notificator, window: float = DIGEST_WINDOW, max_pending: int = DIGEST_MAX_PENDING):
+        self.notificator = notificator
+        self.window = window
+        self.pending = dict()
+        self.flushes = set()
+        # One slot per held message, released once the sender accepted it
+        self.slots = asyncio.Semaphore(max_pending)
+
+    async def send_message(self, chat_id: int, text: str, deliveries: list = ()):
+        text = truncate(text)
+        if self.window <= 0:
+            await self.notificator.send_message(chat_id, text, deliveries)
+            return
+
+        await self.slots.acquire()
+        pending = self.pending.get(chat_id)
+        if pending != None:
+            pending[0].append(text)
+            pending[1].extend(deliveries)
+            return
+
+        self.pending[chat_id] = ([text], list(deliveries))
+        flush = asyncio.create_task(self._flush_later(chat_id))
+        # Keep a reference, otherwise the task could be garbage collected before it runs
+        self.flushes.add(flush)
+        flush.add_done_callback(self.flushes.discard)
+
+    async def drain(self):
+        """Waits until every pending digest has been handed on."""
+        while self.flushes:
+            await asyncio.gather(*self.flushes)
+
+    async def _flush_later(self, chat_id: int):
+        await asyncio.sleep(self.window)
+        texts, deliveries = self.pending.pop(chat_id)
+
+        try:
+            if len(texts) == 1:
+                await self.notificator.send_message(chat_id, texts[0], deliveries)
+                return
+
+            # Settled with the first part of the digest
+            for digest in self._render(texts):
+                await self.notificator.send_message(chat_id, digest, deliveries)
+                deliveries = ()
+        finally:
+            for _ in texts:
+                self.slots.release()
+
+    def _render(self, texts: list) -> list:
+        messages = list()
+        current = f"You have {html.bold(str(len(texts)))} updates on your tasks:"
+        for text in texts:
+            if len(current) + len(text) + 2 > MAX_MESSAGE_LENGTH:
+                messages.append(current)
+                current = text
+            else:
+                current += "\n\n" + text
+        messages.append(current)
+
+        return messages
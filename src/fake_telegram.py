@@ -0,0 +1,176 @@
+"""Minimal stand-in for the Telegram Bot API, to run the bot locally without Telegram.
+
+    python fake_telegram.py serve --port 8081
+    TELEGRAM_API_URL=http://localhost:8081 BOT_MODE=webhook WEBHOOK_URL=http://localhost:8080 WEBHOOK_SECRET=test python supervisor.py
+    python fake_telegram.py send "/tasks"
+    python fake_telegram.py send --callback "select_tasks"
+    python fake_telegram.py fail 429 --retry-after 5
+
+Every Bot API call the bot makes is printed and kept; GET /fake/calls returns them as JSON.
+"fail" makes the next sendMessage to the user answer with an error, e.g. a flood wait.
+Updates go to the webhook the bot registered, or to getUpdates when it polls.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import time
+
+import aiohttp
+from aiohttp import web
+
+FAKE_BOT_USER = {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+
+
+class FakeTelegram:
+    def __init__(self):
+        self.calls = list()
+        self.webhook = None
+        self.secret = None
+        self.updates = asyncio.Queue()
+        self.last_message = dict()
+        self.ids = itertools.count(1)
+        # Error responses for the next sendMessage calls, per chat
+        self.failures = dict()
+
+    def fail_next(self, chat_id: int, error_code: int, description: str = "Injected error", retry_after: int = None):
+        response = {"ok": False, "error_code": error_code, "description": description}
+        if retry_after != None:
+            response["parameters"] = {"retry_after": retry_after}
+        self.failures.setdefault(chat_id, list()).append(response)
+
+    def _message(self, chat_id: int, text: str = None, reply_markup: str = None) -> dict:
+        message = {"message_id": next(self.ids), "date": int(time.time()), "chat": {"id": chat_id, "type": "private"}, "from": FAKE_BOT_USER}
+        if text != None:
+            message["text"] = text
+        if reply_markup:
+            message["reply_markup"] = json.loads(reply_markup)
+
+        return message
+
+    async def handle_method(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        if not params and request.can_read_body:
+            params = await request.json()
+        self.calls.append({"method": method, "params": params})
+
+        if method == "getUpdates":
+            return await self._get_updates(params)
+
+        print(f"fake telegram: {method} {params}")
+        if method == "sendMessage" and self.failures.get(int(params.get("chat_id") or 0)):
+            response = self.failures[int(params["chat_id"])].pop(0)
+            return web.json_response(response, status=response["error_code"])
+
+        if method == "getMe":
+            result = FAKE_BOT_USER
+        elif method == "setWebhook":
+            self.webhook = params.get("url")
+            self.secret = params.get("secret_token")
+            result = True
+        elif method == "deleteWebhook":
+            self.webhook = None
+            result = True
+        elif method in ("sendMessage", "editMessageText", "editMessageReplyMarkup"):
+            chat_id = int(params.get("chat_id") or 0)
+            previous = self.last_message.get(chat_id, {})
+            result = self._message(chat_id, params.get("text", previous.get("text")), params.get("reply_markup"))
+            self.last_message[chat_id] = result
+        else:
+            result = True
+
+        return web.json_response({"ok": True, "result": result})
+
+    async def _get_updates(self, params: dict) -> web.Response:
+        try:
+            update = await asyncio.wait_for(self.updates.get(), timeout=float(params.get("timeout", 10)))
+            result = [update]
+        except asyncio.TimeoutError:
+            result = []
+
+        return web.json_response({"ok": True, "result": result})
+
+    def _update(self, user_id: int, text: str = None, callback_data: str = None) -> dict:
+        user = {"id": user_id, "is_bot": False, "first_name": "Tester"}
+        if callback_data != None:
+            message = self.last_message.get(user_id) or self._message(user_id, "")
+            return {"update_id": next(self.ids), "callback_query": {
+                "id": str(next(self.ids)), "from": user, "chat_instance": str(user_id), "data": callback_data, "message": message,
+            }}
+
+        message = {"message_id": next(self.ids), "date": int(time.time()), "chat": {"id": user_id, "type": "private"}, "from": user, "text": text}
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+
+        return {"update_id": next(self.ids), "message": message}
+
+    async def handle_fake_update(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        update = self._update(int(body.get("user_id", 100)), body.get("text"), body.get("callback_data"))
+
+        if self.webhook == None:
+            await self.updates.put(update)
+            return web.json_response({"delivered": "getUpdates"})
+
+        headers = {"X-Telegram-Bot-Api-Secret-Token": self.secret} if self.secret else {}
+        async with aiohttp.ClientSession() as session:
+            async with session.post(self.webhook, json=update, headers=headers) as response:
+                return web.json_response({"delivered": "webhook", "status": response.status})
+
+    async def handle_fake_fail(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        self.fail_next(int(body.get("user_id", 100)), int(body["error_code"]), body.get("description", "Injected error"), body.get("retry_after"))
+        return web.json_response({"queued": True})
+
+    async def handle_fake_calls(self, request: web.Request) -> web.Response:
+        return web.json_response(self.calls)
+
+
+def create_app(fake: FakeTelegram = None) -> web.Application:
+    fake = fake or FakeTelegram()
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", fake.handle_method)
+    app.router.add_post("/fake/update", fake.handle_fake_update)
+    app.router.add_post("/fake/fail", fake.handle_fake_fail)
+    app.router.add_get("/fake/calls", fake.handle_fake_calls)
+    return app
+
+
+async def send(server: str, user_id: int, text: str, callback_data: str):
+    async with aiohttp.ClientSession() as session:
+        async with session.post(f"{server}/fake/update", json={"user_id": user_id, "text": text, "callback_data": callback_data}) as response:
+            print(await response.json())
+
+
+async def fail(server: str, user_id: int, error_code: int, description: str, retry_after: int):
+    async with aiohttp.ClientSession() as session:
+        body = {"user_id": user_id, "error_code": error_code, "description": description, "retry_after": retry_after}
+        async with session.post(f"{server}/fake/fail", json=body) as response:
+            print(await response.json())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake Telegram Bot API server")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve_parser = commands.add_parser("serve")
+    serve_parser.add_argument("--port", type=int, default=8081)
+    send_parser = commands.add_parser("send", help="deliver a message or button press from a fake user")
+    send_parser.add_argument("text", nargs="?", default="")
+    send_parser.add_argument("--callback", help="callback data of the pressed button")
+    send_parser.add_argument("--user-id", type=int, default=100)
+    send_parser.add_argument("--server", default="http://localhost:8081")
+    fail_parser = commands.add_parser("fail", help="answer the next message to a user with an error")
+    fail_parser.add_argument("error_code", type=int, help="e.g. 429 flood wait, 403 bot blocked, 500 server error")
+    fail_parser.add_argument("--description", default="Injected error")
+    fail_parser.add_argument("--retry-after", type=int, help="seconds, for 429")
+    fail_parser.add_argument("--user-id", type=int, default=100)
+    fail_parser.add_argument("--server", default="http://localhost:8081")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        web.run_app(create_app(), port=args.port)
+    elif args.command == "fail":
+        asyncio.run(fail(args.server, args.user_id, args.error_code, args.description, args.retry_after))
+    else:
+        asyncio.run(send(args.server, args.user_id, args.text, args.callback))
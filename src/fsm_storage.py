@@ -0,0 +1,58 @@
+import json
+import os
+from datetime import datetime, timedelta
+
+from aiogram.fsm.storage.base import BaseStorage
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.fsm.storage.redis import RedisStorage
+
+from redis_api import async_r
+
+# "redis" shares conversations between bot processes and keeps them across restarts
+FSM_STORAGE = os.environ.get("FSM_STORAGE", "redis")
+# Abandoned conversations expire instead of piling up in Redis
+FSM_TTL = timedelta(days=1)
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return {"$dt": value.timestamp()}
+    if isinstance(value, timedelta):
+        return {"$td": value.total_seconds()}
+
+    raise TypeError(f"cannot store {type(value).__name__} in FSM state")
+
+
+def _decode(obj: dict):
+    if len(obj) == 1:
+        if "$dt" in obj:
+            return datetime.fromtimestamp(obj["$dt"])
+        if "$td" in obj:
+            return timedelta(seconds=obj["$td"])
+
+    return obj
+
+
+def dumps(data) -> str:
+    """JSON without whitespace; datetime and timedelta become one-key objects holding a number."""
+    return json.dumps(data, default=_encode, separators=(",", ":"))
+
+
+def loads(data):
+    return json.loads(data, object_hook=_decode)
+
+
+class SharedRedisStorage(RedisStorage):
+    """RedisStorage on the process's shared client. The dispatcher closes its storage on
+    shutdown, while the sender is still draining through the same pool; connections.async_close
+    closes it once everything is done."""
+
+    async def close(self) -> None:
+        pass
+
+
+def create_fsm_storage() -> BaseStorage:
+    if FSM_STORAGE == "redis":
+        return SharedRedisStorage(async_r, state_ttl=FSM_TTL, data_ttl=FSM_TTL, json_loads=loads, json_dumps=dumps)
+
+    return MemoryStorage()
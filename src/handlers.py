@@ -6,7 +6,8 @@ from aiogram.fsm.context import FSMContext
 
 from datetime import datetime, timedelta
 
-from mongo_api import Task, Notification
+from async_mongo_api import AsyncTask as Task, AsyncNotification as Notification
+from redis_api import async_wake_notifier
 
 import re
 
@@ -28,6 +29,9 @@ class EditTask(StatesGroup):
     choosing_field = State()  
     editing_field = State()  
 
+class SelectTasks(StatesGroup):
+    selecting = State()
+
 class SearchTask(StatesGroup):
     waiting_for_date = State()
     displaying_tasks = State()  
@@ -58,23 +62,95 @@ async def cmd_help(message: Message):
 @router.message(Command("tasks"))
 async def cmd_tasks(message: Message):
     user_id = message.from_user.id
-    user_tasks = Task.get_all_by_user(user_id)
+    user_tasks, has_prev, has_next = await Task.get_page_by_user(user_id)
 
     if not user_tasks:
         await message.answer("You have no tasks assigned.")
         return
 
 
-    reply_markup = kb.create_task_keyboard(user_tasks)
+    reply_markup = kb.create_task_keyboard(user_tasks, has_prev, has_next)
 
     await message.answer("Your tasks:", reply_markup=reply_markup)
 
+# --- TASK LIST PAGES ---
+@router.callback_query(F.data.startswith("tasks_page:"))
+async def tasks_page_callback(callback: CallbackQuery):
+    _, direction, cursor_deadline, cursor_id = callback.data.split(":")
+    cursor = (datetime.strptime(cursor_deadline, kb.PAGE_CURSOR_FORMAT), cursor_id)
+
+    user_id = callback.from_user.id
+    if direction == "next":
+        user_tasks, has_prev, has_next = await Task.get_page_by_user(user_id, after=cursor)
+    else:
+        user_tasks, has_prev, has_next = await Task.get_page_by_user(user_id, before=cursor)
+
+    if not user_tasks:
+        await callback.answer("No more tasks.")
+        return
+
+    await callback.message.edit_reply_markup(reply_markup=kb.create_task_keyboard(user_tasks, has_prev, has_next))
+    await callback.answer()
+
+
+# --- SELECT SEVERAL TASKS TO COMPLETE ---
+@router.callback_query(F.data == "select_tasks")
+async def select_tasks_callback(callback: CallbackQuery, state: FSMContext):
+    # The tasks of the page on screen are taken from its keyboard, no need to query them again
+    tasks = [
+        (button.callback_data.split(":")[1], button.text)
+        for row in callback.message.reply_markup.inline_keyboard
+        for button in row
+        if button.callback_data.startswith("task:")
+    ]
+
+    await state.set_state(SelectTasks.selecting)
+    await state.update_data(selecting_tasks=tasks, selected_tasks=[])
+    await callback.message.edit_text("Select the tasks you have completed:", reply_markup=kb.create_select_tasks_keyboard(tasks, []))
+    await callback.answer()
+
+@router.callback_query(F.data.startswith("task_select:"), SelectTasks.selecting)
+async def toggle_task_selection_callback(callback: CallbackQuery, state: FSMContext):
+    task_id = callback.data.split(":")[1]
+    data = await state.get_data()
+    selected = data.get("selected_tasks", [])
+
+    if task_id in selected:
+        selected.remove(task_id)
+    else:
+        selected.append(task_id)
+
+    await state.update_data(selected_tasks=selected)
+    await callback.message.edit_reply_markup(reply_markup=kb.create_select_tasks_keyboard(data.get("selecting_tasks", []), selected))
+    await callback.answer()
+
+@router.callback_query(F.data == "complete_selected_tasks", SelectTasks.selecting)
+async def complete_selected_tasks_callback(callback: CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    selected = data.get("selected_tasks", [])
+
+    if not selected:
+        await callback.answer("No tasks selected.", show_alert=True)
+        return
+
+    completed = await Task.delete_by_ids(selected, callback.from_user.id)
+    await state.clear()
+
+    await callback.message.edit_text(f"{completed} tasks completed.", reply_markup=None)
+    await callback.answer()
+
+@router.callback_query(F.data == "cancel_selecting_tasks")
+async def cancel_selecting_tasks_callback(callback: CallbackQuery, state: FSMContext):
+    await state.clear()
+    await callback.message.edit_text("Selection cancelled.", reply_markup=None)
+    await callback.answer()
+
 
 # --- TASK DETAIL CALLBACK ---
 @router.callback_query(F.data.startswith("task:"))
 async def task_detail_callback(callback: CallbackQuery):
     task_id = callback.data.split(":")[1]
-    task = Task.get_task_by_id(task_id)
+    task = await Task.get_task_by_id(task_id)
 
     if not task:
         await callback.answer("Task not found.", show_alert=True)
@@ -113,15 +189,17 @@ async def task_detail_callback(callback: CallbackQuery):
     await callback.answer()
 
 # --- Function to add a task
-def add_task(
+async def add_task(
     user_id: int, title: str, description: str, deadline: datetime, reminder_time: datetime = None, reminder_count: int = 1, reminder_period: int = timedelta(days=1)) -> int:  # Return task ID
     
     added_task = Task(user_id, title, description, deadline)
-    added_task.insert()
+    await added_task.insert()
 
     if(reminder_time != None):
-        added_notification = Notification(reminder_time, reminder_period, reminder_count, added_task._id)
-        added_notification.insert()
+        added_notification = Notification(reminder_time, reminder_period, reminder_count, added_task._id, user_id=user_id)
+        await added_notification.insert()
+
+    await async_wake_notifier()
 
     return added_task._id 
 
@@ -169,7 +247,7 @@ async def add_task_reminder_time(message: Message, state: FSMContext):
     elif message.text.lower() in ["no", "n"]:
         # Если пользователь не хочет напоминание, добавляем задачу без напоминаний
         data = await state.get_data()
-        add_task(
+        await add_task(
             message.from_user.id,
             data["title"],
             data["description"],
@@ -215,7 +293,7 @@ async def set_reminder_period(message: Message, state: FSMContext):
         await state.set_state(AddTask.reminder_period)
     elif message.text.lower() == "no":
         data = await state.get_data()
-        add_task(
+        await add_task(
             message.from_user.id,
             data["title"],
             data["description"],
@@ -292,7 +370,7 @@ async def input_reminder_count(message: Message, state: FSMContext):
         data = await state.get_data()
 
 
-        add_task(
+        await add_task(
             message.from_user.id,
             data["title"],
             data["description"],
@@ -319,7 +397,7 @@ async def input_reminder_count(message: Message, state: FSMContext):
 @router.callback_query(F.data.startswith("edit_task:"))
 async def edit_task_callback(callback: CallbackQuery, state: FSMContext):
     task_id = callback.data.split(":")[1]
-    task = Task.get_task_by_id(task_id)
+    task = await Task.get_task_by_id(task_id)
 
     if not task:
         await callback.answer("Task not found.", show_alert=True)
@@ -363,7 +441,7 @@ async def edit_task_value(message: Message, state: FSMContext):
     task_id = data.get("task_id")
     field_to_edit = data.get("field_to_edit")
 
-    task_db = Task.get_task_by_id(task_id)
+    task_db = await Task.get_task_by_id(task_id)
 
     if task_id is None or field_to_edit is None or task_db is None:
         await message.answer("An error occurred. Please try again.")
@@ -373,11 +451,12 @@ async def edit_task_value(message: Message, state: FSMContext):
 
     if field_to_edit == "title":
         task_db.title = message.text
-        task_db.commit()
+        # Only the edited field: the cached task may predate the notifier extending its deadline
+        await task_db.commit(("title",))
 
     elif field_to_edit == "description":
         task_db.description = message.text
-        task_db.commit()
+        await task_db.commit(("description",))
 
     elif field_to_edit == "deadline":
         try:
@@ -386,7 +465,8 @@ async def edit_task_value(message: Message, state: FSMContext):
                 await message.answer("Deadline cannot be in the past. Please enter a future date.")
                 return
             task_db.deadline = deadline
-            task_db.commit()
+            await task_db.commit(("deadline",))
+            await async_wake_notifier()
             
         except ValueError:
             await message.answer("Invalid date format. Please use YYYY-MM-DD HH:MM")
@@ -433,7 +513,7 @@ async def finish_editing_callback(callback: CallbackQuery, state: FSMContext):
     await state.clear()
 
     #Confirmation Message
-    updated_task = Task.get_task_by_id(task_id)
+    updated_task = await Task.get_task_by_id(task_id)
     title = updated_task.title
     description = updated_task.description
     deadline = updated_task.deadline
@@ -454,11 +534,11 @@ async def finish_editing_callback(callback: CallbackQuery, state: FSMContext):
 @router.callback_query(F.data.startswith("delete_task:"))
 async def delete_task_callback(callback: CallbackQuery):
     task_id = callback.data.split(":")[1]
-    task = Task.get_task_by_id(task_id)
+    task = await Task.get_task_by_id(task_id)
 
     if task:
         title = task.title
-        task.delete()
+        await task.delete()
 
         await callback.message.edit_text(
             f"Task '{title}' completed.", reply_markup=None  # Remove the keyboard
@@ -468,33 +548,61 @@ async def delete_task_callback(callback: CallbackQuery):
         await callback.answer("Task not found.", show_alert=True)
 
 
-# 3. Callback Handler for Search Button
+# 3. Callback Handler for Search Button, shows the current month with per-day task counts
 @router.callback_query(F.data == "search_tasks_by_day")
 async def search_tasks_callback(callback_query: CallbackQuery, state: FSMContext):
+    await callback_query.answer()
+    today = datetime.now()
+    counts = await Task.get_month_counts(callback_query.from_user.id, today.year, today.month)
+    await callback_query.message.answer("Choose a day:", reply_markup=kb.create_calendar_keyboard(today.year, today.month, counts))
+
+@router.callback_query(F.data.startswith("calendar:"))
+async def calendar_month_callback(callback_query: CallbackQuery):
+    month = datetime.strptime(callback_query.data.split(":", 1)[1], "%Y-%m")
+    counts = await Task.get_month_counts(callback_query.from_user.id, month.year, month.month)
+    await callback_query.message.edit_reply_markup(reply_markup=kb.create_calendar_keyboard(month.year, month.month, counts))
+    await callback_query.answer()
+
+@router.callback_query(F.data == "calendar_ignore")
+async def calendar_ignore_callback(callback_query: CallbackQuery):
+    await callback_query.answer()
+
+@router.callback_query(F.data.startswith("calendar_day:"))
+async def calendar_day_callback(callback_query: CallbackQuery, state: FSMContext):
+    await callback_query.answer()
+    day = datetime.strptime(callback_query.data.split(":", 1)[1], "%Y-%m-%d")
+    await show_tasks_by_day(callback_query.message, state, day, callback_query.from_user.id)
+
+@router.callback_query(F.data == "search_tasks_by_date_input")
+async def search_tasks_by_date_input_callback(callback_query: CallbackQuery, state: FSMContext):
     await callback_query.answer()
     await callback_query.message.answer("Please enter the date in <b>YYYY-MM-DD</b> format:", parse_mode="HTML")
     await state.set_state(SearchTask.waiting_for_date)
 
+async def show_tasks_by_day(message: Message, state: FSMContext, day: datetime, user_id: int):
+    await state.update_data(search_date=day)  # Store the datetime object in state
+    tasks_by_day = await Task.get_all_by_day(day, user_id)
+    if tasks_by_day:
+        # Here can add delete function as well
+        reply_markup = kb.create_tasks_by_day_keyboard(tasks_by_day)
+        await message.answer(f"Tasks for {day.strftime('%Y-%m-%d')}:", reply_markup=reply_markup)
+        await state.set_state(SearchTask.displaying_tasks) # Important
+    else:
+        await message.answer("No tasks found for that date.")
+        await state.clear()  # Clear state after processing
+
 # 4. Message Handler for Date Input
 @router.message(SearchTask.waiting_for_date)
 async def ask_day(message: Message, state: FSMContext):
     try:
         day = datetime.strptime(message.text, "%Y-%m-%d")
-        await state.update_data(search_date=day)  # Store the datetime object in state
-        await message.answer("Searching tasks...")
-        user_id = message.from_user.id
-        tasks_by_day = Task.get_all_by_day(day, user_id)
-        if tasks_by_day:
-            # Here can add delete function as well
-            reply_markup = kb.create_tasks_by_day_keyboard(tasks_by_day)
-            await message.answer(f"Tasks for {message.text}:", reply_markup=reply_markup)
-            await state.set_state(SearchTask.displaying_tasks) # Important
-        else:
-            await message.answer("No tasks found for that date.")
-            await state.clear()  # Clear state after processing
     except ValueError:
         await message.answer("Invalid date format. Please use <b>YYYY-MM-DD</b>", parse_mode="HTML")
         await state.clear()  # Clear the state if there's an error
+        return
+
+    await message.answer("Searching tasks...")
+    await show_tasks_by_day(message, state, day, message.from_user.id)
 
 
 # 5. Corrected Callback Handler for Deleting Tasks
@@ -507,7 +615,7 @@ async def delete_tasks_by_day_callback(callback_query: CallbackQuery, state: FSM
 
     if day:
         user_id = callback_query.from_user.id
-        Task.delete_all_by_day(day, user_id) #Delete operation goes here
+        await Task.delete_all_by_day(day, user_id) #Delete operation goes here
 
         await callback_query.message.answer(f"All tasks for {day.strftime('%Y-%m-%d')} deleted successfully.")
     else:
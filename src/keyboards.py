@@ -2,14 +2,24 @@ from aiogram.types import (KeyboardButton, ReplyKeyboardMarkup,
                            InlineKeyboardButton,InlineKeyboardMarkup)
 from aiogram.utils.keyboard import ReplyKeyboardBuilder
 
+import calendar
 
 
-def create_task_keyboard(user_tasks: list) -> InlineKeyboardMarkup:
+# A task's (deadline, _id) position, used as the page cursor in callback data
+PAGE_CURSOR_FORMAT = "%Y%m%d%H%M%S%f"
+
+
+def page_cursor(task) -> str:
+    return f"{task.deadline.strftime(PAGE_CURSOR_FORMAT)}:{task._id}"
+
+
+def create_task_keyboard(user_tasks: list, has_prev: bool = False, has_next: bool = False) -> InlineKeyboardMarkup:
     keyboard = []
 
-    # Add the search button as the first button
+    # Add the search and select buttons as the first row
     search_button = InlineKeyboardButton(text="🔍", callback_data="search_tasks_by_day")
-    keyboard.append([search_button])  # Add as a row
+    select_button = InlineKeyboardButton(text="☑️", callback_data="select_tasks")
+    keyboard.append([search_button, select_button])  # Add as a row
 
     for task in user_tasks:
         keyboard.append(
@@ -19,6 +29,66 @@ def create_task_keyboard(user_tasks: list) -> InlineKeyboardMarkup:
                 )
             ]
         )
+
+    navigation = []
+    if has_prev:
+        navigation.append(InlineKeyboardButton(text="⬅️", callback_data=f"tasks_page:prev:{page_cursor(user_tasks[0])}"))
+    if has_next:
+        navigation.append(InlineKeyboardButton(text="➡️", callback_data=f"tasks_page:next:{page_cursor(user_tasks[-1])}"))
+    if navigation:
+        keyboard.append(navigation)
+
+    reply_markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
+    return reply_markup
+
+def create_select_tasks_keyboard(tasks: list, selected: list) -> InlineKeyboardMarkup:
+    """Creates a keyboard to pick several tasks; tasks is a list of (task_id, title) pairs."""
+    keyboard = []
+
+    for task_id, title in tasks:
+        mark = "✅ " if task_id in selected else ""
+        keyboard.append(
+            [
+                InlineKeyboardButton(
+                    text=f"{mark}{title}", callback_data=f"task_select:{task_id}"
+                )
+            ]
+        )
+
+    keyboard.append([
+        InlineKeyboardButton(text=f"✔️ ({len(selected)})", callback_data="complete_selected_tasks"),
+        InlineKeyboardButton(text="✖️", callback_data="cancel_selecting_tasks"),
+    ])
+    reply_markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
+    return reply_markup
+
+def create_calendar_keyboard(year: int, month: int, counts: dict) -> InlineKeyboardMarkup:
+    """Creates a month grid; counts maps day of month to the number of tasks due that day."""
+    previous_month = (year - 1, 12) if month == 1 else (year, month - 1)
+    next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+    keyboard = [
+        [
+            InlineKeyboardButton(text="⬅️", callback_data=f"calendar:{previous_month[0]}-{previous_month[1]:02d}"),
+            InlineKeyboardButton(text=f"{calendar.month_name[month]} {year}", callback_data="calendar_ignore"),
+            InlineKeyboardButton(text="➡️", callback_data=f"calendar:{next_month[0]}-{next_month[1]:02d}"),
+        ],
+        [InlineKeyboardButton(text=day, callback_data="calendar_ignore") for day in ("Mo", "Tu", "We", "Th", "Fr", "Sa", "Su")],
+    ]
+
+    for week in calendar.monthcalendar(year, month):
+        row = []
+        for day in week:
+            count = counts.get(day, 0)
+            if day == 0:
+                row.append(InlineKeyboardButton(text=" ", callback_data="calendar_ignore"))
+            elif count:
+                row.append(InlineKeyboardButton(text=f"{day} ({count})", callback_data=f"calendar_day:{year}-{month:02d}-{day:02d}"))
+            else:
+                # Nothing to open, so no query either
+                row.append(InlineKeyboardButton(text=str(day), callback_data="calendar_ignore"))
+        keyboard.append(row)
+
+    keyboard.append([InlineKeyboardButton(text="⌨️ Type a date", callback_data="search_tasks_by_date_input")])
     reply_markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
     return reply_markup
 
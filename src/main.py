@@ -1,26 +1,43 @@
+import argparse
 import asyncio
 import logging
+import os
+import signal
 import sys
 
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.enums import ParseMode
 from aiogram import html
 
 from handlers import router
+from metrics import HandlerTimer, start_metrics_server, run_heartbeat, BOT_METRICS_PORT
+from mongo_api import ensure_indexes
+import connections
+from async_mongo_api import AsyncTask as Task
 
 from aiogram import Bot
 
-import redis
-import json
+import redis.asyncio
 
-REDIS_HOST = "localhost"
-REDIS_PORT = 27020
-REDIS_DB = 0
-REDIS_QUEUE_REMINDERS = "reminders"
-REDIS_QUEUE_DEADLINES = "expired"
+from redis_api import async_r, run_timer_retries, QUEUE_MODE, REDIS_QUEUE_REMINDERS, REDIS_QUEUE_DEADLINES
+from sender import Sender
+from digest import Digester
+import payload
+from reliable_queue import Delivery, ReliableConsumer
+from stream_queue import StreamConsumer
+from fsm_storage import create_fsm_storage
+from task_cache import listen_invalidations
+from webhook import run_webhook
 
-TOKEN = '8044024877:AAEPIz1ImnnDWXFmmwE4qSGgaHg7txWjPhk'
+# How many extra messages to take from each queue per wakeup when queues are deep
+REDIS_POP_BATCH = 100
+# On SIGTERM, how long to keep sending what was already taken from the queues
+BOT_DRAIN_TIMEOUT = 20
+
+TOKEN = os.environ.get("BOT_TOKEN", '8044024877:AAEPIz1ImnnDWXFmmwE4qSGgaHg7txWjPhk')
 
 # TOKEN = None
 
@@ -28,73 +45,167 @@ TOKEN = '8044024877:AAEPIz1ImnnDWXFmmwE4qSGgaHg7txWjPhk'
 #     print("Paste your token in main.py::23")
 #     sys.exit()
 
-import threading
-import subprocess
-
-
-def run_in_another_thread(path):
-    subprocess.Popen(['python', path])
-
-async def consumer_reminders(redis: redis.Redis, notificator):  # No need for aioredis now
-
-    while True:
-        result = await asyncio.to_thread(redis.blpop, REDIS_QUEUE_REMINDERS, timeout=3)  # Wrap in asyncio.to_thread
-        if result:
-            _, message_data_bytes = result
-            message_data_str = message_data_bytes.decode('utf-8')
-            try:
-                message_data = json.loads(message_data_str)
-                print("in reminder got: ", message_data)
-                user_id = message_data.get("user_id")
-                title = message_data.get("title")
-                deadline = message_data.get("deadline")
-                await notificator.send_message(user_id, f"Remind you about your deadline on task {html.bold(title)},\nPlease notice: your deadline is on {html.bold(deadline)}")
-            except json.JSONDecodeError:
-                print(f"Consumer: Could not decode JSON: {message_data_str}")
-        else:
-            #print("Consumer: No messages in the queue, yielding control...")
-            await asyncio.sleep(0.1)
-
-async def consumer_deadline_expired(redis: redis.Redis, notificator):
+async def send_reminder(task, notificator, deliveries: list):
+    await notificator.send_message(task.user_id, f"Remind you about your deadline on task {html.bold(task.title)},\nPlease notice: your deadline is on {html.bold(task.deadline.isoformat())}",
+                                   deliveries)
+
+async def send_deadline_expired(task, notificator, deliveries: list):
+    await notificator.send_message(task.user_id, f'You missed your task {html.bold(task.title)}\nWe have extended your deadline by {html.italic("1 day")}\nPlease notice: your deadline currently is on {html.bold(task.deadline.isoformat())}',
+                                   deliveries)
+
+EVENT_SENDERS = {
+    payload.EVENT_REMINDER: send_reminder,
+    payload.EVENT_DEADLINE_EXPIRED: send_deadline_expired,
+}
+QUEUES = [REDIS_QUEUE_REMINDERS, REDIS_QUEUE_DEADLINES]
+
+async def handle_messages(deliveries: list, notificator):
+    events = list()
+    for delivery in deliveries:
+        try:
+            event = payload.decode(delivery.queue, delivery.raw)
+        except ValueError as e:
+            print(f"Consumer: Could not decode message {delivery.raw!r}: {e}")
+            await delivery.fail(f"undecodable message: {e}", permanent=True)
+            continue
+
+        if event.event not in EVENT_SENDERS:
+            print(f"Consumer: Unknown event {event.event}")
+            await delivery.fail(f"unknown event {event.event}", permanent=True)
+            continue
+
+        delivery.due = event.due
+        events.append((event, delivery))
+
+    # Current title and deadline of every task in the batch, in one query
+    tasks = {task._id: task for task in await Task.get_by_ids({event.task_id for event, _ in events if event.task == None})}
+    for event, delivery in events:
+        task = event.task or tasks.get(event.task_id)
+        if task == None:
+            # Deleted or completed since the event was queued, nothing left to tell the user
+            print(f"Consumer: task {event.task_id} no longer exists, dropping reminder")
+            await delivery.ack()
+            continue
+
+        await EVENT_SENDERS[event.event](task, notificator, [delivery])
+
+async def consumer(redis: redis.asyncio.Redis, notificator):
     while True:
-        result = await asyncio.to_thread(redis.blpop, REDIS_QUEUE_DEADLINES, timeout=3)  # Wrap in asyncio.to_thread
-        if result:
-            _, message_data_bytes = result
-            message_data_str = message_data_bytes.decode('utf-8')
-            try:
-                message_data = json.loads(message_data_str)
-                user_id = message_data["user_id"]
-                title = message_data["title"]
-                desc = message_data["description"]
-                deadline = message_data["deadline"]
-                await notificator.send_message(user_id, f'You missed your task {html.bold(title)}\nWe have extended your deadline by {html.italic("1 day")}\nPlease notice: your deadline currently is on {html.bold(deadline)}')
-
-            except json.JSONDecodeError:
-                print(f"Consumer: Could not decode JSON: {message_data_str}")
-        else:
-            #print("Consumer: No messages in the queue, yielding control...")
-            await asyncio.sleep(0.1)
-
-async def main():
+        # One blocking pop over both queues, no thread and no polling while idle
+        queue_bytes, message_data_bytes = await redis.blpop(QUEUES, timeout=0)
+        batch = [Delivery(queue_bytes.decode('utf-8'), message_data_bytes)]
+
+        # Drain whatever else is waiting in one round trip
+        async with redis.pipeline(transaction=False) as pipe:
+            for queue in QUEUES:
+                pipe.lpop(queue, REDIS_POP_BATCH)
+            popped = await pipe.execute()
+        for queue, messages in zip(QUEUES, popped):
+            batch.extend(Delivery(queue, message) for message in messages or [])
+
+        await handle_messages(batch, notificator)
+
+def create_consumer(redis: redis.asyncio.Redis, notificator):
+    if QUEUE_MODE == "simple":
+        return consumer(redis, notificator)
+
+    async def handle(deliveries: list):
+        await handle_messages(deliveries, notificator)
+
+    if QUEUE_MODE == "stream":
+        return StreamConsumer(redis, QUEUES, handle, batch=REDIS_POP_BATCH).run()
+
+    return ReliableConsumer(redis, QUEUES, handle, batch=REDIS_POP_BATCH).run()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Task manager bot")
+    parser.add_argument("--mode", choices=["polling", "webhook"], default=os.environ.get("BOT_MODE", "polling"))
+    parser.add_argument("--webhook-url", default=os.environ.get("WEBHOOK_URL"), help="public base url Telegram should post to")
+    parser.add_argument("--webhook-path", default=os.environ.get("WEBHOOK_PATH", "/webhook"))
+    parser.add_argument("--webhook-host", default=os.environ.get("WEBHOOK_HOST", "0.0.0.0"))
+    parser.add_argument("--webhook-port", type=int, default=int(os.environ.get("WEBHOOK_PORT", "8080")))
+    parser.add_argument("--api-url", default=os.environ.get("TELEGRAM_API_URL"), help="Bot API server, e.g. fake_telegram.py")
+    parser.add_argument("--webhook-insecure", action="store_true", default=os.environ.get("WEBHOOK_INSECURE", "0") == "1",
+                        help="accept webhook updates without WEBHOOK_SECRET, e.g. behind a proxy that checks them")
+    args = parser.parse_args()
+
+    # Without the secret anyone who finds the url can post updates as any user
+    if args.mode == "webhook" and not os.environ.get("WEBHOOK_SECRET") and not args.webhook_insecure:
+        parser.error("webhook mode needs WEBHOOK_SECRET, or --webhook-insecure to run without one")
+    return args
+
+async def main(args):
     # Initialize Bot instance with default bot properties which will be passed to all API calls
-    bot = Bot(token=TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-    dp = Dispatcher()
+    session = AiohttpSession(api=TelegramAPIServer.from_base(args.api_url)) if args.api_url else None
+    bot = Bot(token=TOKEN, session=session, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    # Conversation state lives in Redis, so any bot process can continue it
+    dp = Dispatcher(storage=create_fsm_storage())
 
     # And the run events dispatching
     dp.include_router(router)
+    # Inner middlewares only see updates that matched a handler
+    router.message.middleware(HandlerTimer())
+    router.callback_query.middleware(HandlerTimer())
+    start_metrics_server(BOT_METRICS_PORT)
+
+    ensure_indexes()
+    if connections.CONNECTIONS_WARM_UP:
+        await connections.async_warm_up()
+
+    # Consumers hand messages to the digester, which merges bursts per user,
+    # then to the sender, which paces them to Telegram's limits
+    sender = Sender(bot)
+    digester = Digester(sender)
+
+    if args.mode == "webhook":
+        # The secret only comes from the environment so it does not show up in the process list
+        updates = run_webhook(dp, bot, args.webhook_url, args.webhook_path, args.webhook_host, args.webhook_port, os.environ.get("WEBHOOK_SECRET") or None)
+    else:
+        # Signals are handled below, and the session stays open for draining the sender
+        updates = dp.start_polling(bot, handle_signals=False, close_bot_session=False)
+
+    updates = asyncio.create_task(updates)
+    consuming = asyncio.create_task(create_consumer(async_r, digester))
+    workers = [asyncio.create_task(sender.run()), asyncio.create_task(listen_invalidations()),
+               asyncio.create_task(run_heartbeat()), asyncio.create_task(run_timer_retries())]
+
+    stopping = asyncio.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        asyncio.get_running_loop().add_signal_handler(signum, stopping.set)
+    stop = asyncio.create_task(stopping.wait())
+
+    done, _ = await asyncio.wait([updates, consuming, stop, *workers], return_when=asyncio.FIRST_COMPLETED)
+    if stop not in done:
+        # Something crashed, exit with its error and let the supervisor restart us
+        stop.cancel()
+        for task in done:
+            task.result()
+
+    print("bot: draining")
+    # No new updates or queue messages; what the consumer already took still goes out
+    updates.cancel()
+    consuming.cancel()
+    try:
+        await asyncio.wait_for(drain(digester, sender), BOT_DRAIN_TIMEOUT)
+    except asyncio.TimeoutError:
+        print(f"bot: {sender.queue.qsize()} messages not sent within {BOT_DRAIN_TIMEOUT}s, they are redelivered later")
 
+    for task in workers:
+        task.cancel()
+    await bot.session.close()
+    await connections.async_close()
+    connections.close()
+    print("bot is off!")
 
-    r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB)
-
-    thread = threading.Thread(target=run_in_another_thread, args=('./notifier.py',))
-    thread.start()
 
-    await asyncio.gather(dp.start_polling(bot), consumer_reminders(r, bot), consumer_deadline_expired(r, bot))
+async def drain(digester: Digester, sender: Sender):
+    await digester.drain()
+    await sender.drain()
 
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO, stream=sys.stdout)
     try:
-        asyncio.run(main())
+        asyncio.run(main(parse_args()))
     except KeyboardInterrupt:
         print("bot is off!")
\ No newline at end of file
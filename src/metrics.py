@@ -0,0 +1,104 @@
+import asyncio
+import os
+import time
+
+from aiogram import BaseMiddleware
+from prometheus_client import Histogram, start_http_server
+from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily, REGISTRY
+from pymongo import monitoring
+
+import task_cache
+from stream_queue import group_info
+from redis_api import r, QUEUE_MODE, REDIS_QUEUE_REMINDERS, REDIS_QUEUE_DEADLINES, REDIS_QUEUE_RETRY, REDIS_QUEUE_DEAD
+
+# 0 turns the endpoint off
+BOT_METRICS_PORT = int(os.environ.get("BOT_METRICS_PORT", "9100"))
+NOTIFIER_METRICS_PORT = int(os.environ.get("NOTIFIER_METRICS_PORT", "9101"))
+# Set by the supervisor, which restarts the worker once the file goes stale
+WORKER_HEARTBEAT_FILE = os.environ.get("WORKER_HEARTBEAT_FILE")
+WORKER_HEARTBEAT_INTERVAL = 5
+
+HANDLER_SECONDS = Histogram("bot_handler_seconds", "Time spent in a bot handler", ["handler"])
+MONGO_COMMAND_SECONDS = Histogram("mongo_command_seconds", "Duration of Mongo commands", ["command", "status"],
+                                  buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5))
+NOTIFIER_TICK_SECONDS = Histogram("notifier_tick_seconds", "Duration of one notifier tick")
+REMINDER_LAG_SECONDS = Histogram("reminder_lag_seconds", "Time from a reminder or deadline being due to its message being sent",
+                                 buckets=(.1, .25, .5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600))
+
+
+class HandlerTimer(BaseMiddleware):
+    """Inner router middleware, so it only wraps updates that matched a handler."""
+
+    async def __call__(self, handler, event, data):
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            HANDLER_SECONDS.labels(data["handler"].callback.__name__).observe(time.perf_counter() - started)
+
+
+class MongoCommandTimer(monitoring.CommandListener):
+    """Passed to the Mongo clients as an event listener."""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        MONGO_COMMAND_SECONDS.labels(event.command_name, "ok").observe(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        MONGO_COMMAND_SECONDS.labels(event.command_name, "failed").observe(event.duration_micros / 1e6)
+
+
+class RedisCollector:
+    """Reads queue depths and cache counters when the endpoint is scraped."""
+
+    def collect(self):
+        depth = GaugeMetricFamily("redis_queue_depth", "Messages waiting in a Redis queue", labels=["queue"])
+        for queue in (REDIS_QUEUE_REMINDERS, REDIS_QUEUE_DEADLINES):
+            if QUEUE_MODE == "stream":
+                # Not yet read by any bot, entries read but not acked are pending
+                depth.add_metric([queue], group_info(r, queue)["lag"] or 0)
+            else:
+                depth.add_metric([queue], r.llen(queue))
+        depth.add_metric([REDIS_QUEUE_RETRY], r.zcard(REDIS_QUEUE_RETRY))
+        depth.add_metric([REDIS_QUEUE_DEAD], r.llen(REDIS_QUEUE_DEAD))
+        yield depth
+
+        stats = task_cache.stats()
+        lookups = CounterMetricFamily("task_cache_lookups", "Task cache lookups", labels=["result"])
+        lookups.add_metric(["hit"], stats["hits"])
+        lookups.add_metric(["miss"], stats["misses"])
+        yield lookups
+
+
+def observe_lag(due_times: list):
+    now = time.time()
+    for due in due_times:
+        REMINDER_LAG_SECONDS.observe(max(now - due.timestamp(), 0))
+
+
+def heartbeat():
+    """Tells the supervisor the calling loop is alive. Call it from the loop itself:
+    the metrics endpoint runs in its own thread and answers even when the loop hangs."""
+    if WORKER_HEARTBEAT_FILE == None:
+        return
+
+    with open(WORKER_HEARTBEAT_FILE, "w") as heartbeat_file:
+        heartbeat_file.write(str(time.time()))
+
+
+async def run_heartbeat():
+    # Stops beating when the event loop is blocked
+    while True:
+        heartbeat()
+        await asyncio.sleep(WORKER_HEARTBEAT_INTERVAL)
+
+
+def start_metrics_server(port: int):
+    if port == 0:
+        return
+
+    REGISTRY.register(RedisCollector())
+    start_http_server(port)
+    print(f"metrics: serving on :{port}/metrics")
@@ -1,35 +1,153 @@
 import redis.exceptions
-from mongo_api import Notification, Task
+from mongo_api import Notification, Task, rebuild_timers, ensure_indexes
+from redis_api import (r, wait_for_wakeup, claim_due_timers, get_next_timer, retry_failed_timers, QUEUE_MODE,
+                       REDIS_QUEUE_REMINDERS, REDIS_QUEUE_DEADLINES, REDIS_TIMERS_REMINDERS, REDIS_TIMERS_DEADLINES)
+from stream_queue import add_messages
+import connections
+import payload
+from metrics import start_metrics_server, heartbeat, NOTIFIER_TICK_SECONDS, NOTIFIER_METRICS_PORT
 from datetime import datetime, timedelta
-import redis
-import json
+import os
+import signal
+import time
 
-try:
-    r = redis.Redis(host='localhost', port='27020', db=0)
-    r.ping()
-    print("connected to redis")
-except redis.exceptions.ConnectionError as e:
-    print(f'couldnot connect to redis: {e}')
-    exit()
+# Upper bound for one sleep, so a missed wakeup only delays us this long
+NOTIFIER_MAX_SLEEP = 60
+# Timers lost with Redis's data are only found by rebuilding the sets from Mongo
+NOTIFIER_REBUILD_INTERVAL = int(os.environ.get("NOTIFIER_REBUILD_INTERVAL", "3600"))
+# "redis" finds due items in the Redis timer sets, "mongo" queries Mongo directly
+NOTIFIER_TIMERS = os.environ.get("NOTIFIER_TIMERS", "redis")
+# In "mongo" mode, workers split the documents by user_id modulo NOTIFIER_SHARDS
+NOTIFIER_SHARDS = int(os.environ.get("NOTIFIER_SHARDS", "1"))
+NOTIFIER_SHARD = int(os.environ.get("NOTIFIER_SHARD", "0"))
+SHARD = (NOTIFIER_SHARDS, NOTIFIER_SHARD) if NOTIFIER_SHARDS > 1 else None
+# The timer sets are shared, one worker refilling them is enough
+REBUILDS_TIMERS = NOTIFIER_SHARD == 0
 
-#n = Notification(datetime.now(), timedelta(seconds=2), 10, 0)
-#n.insert()
+# A tick in progress is finished before exiting on SIGTERM, its claimed items are only in memory
+_ticking = False
+_stopping = False
 
-while True:
-    notifications = Notification.get_all()
-    tasks = Task.get_all()
-    current_time = datetime.now()
 
+def _stop(signum, frame):
+    global _stopping
+    _stopping = True
+    if not _ticking:
+        raise SystemExit(0)
 
-    for notification in notifications:
-        wasUpdated = notification.update(current_time)
-        
-        if wasUpdated:
-            r.rpush('reminders', json.dumps(notification.to_dict()))
 
+def claim_due(current_time: datetime):
+    # Only due items are touched, so a tick costs O(due) instead of O(stored)
+    return Notification.claim_due(current_time, shard=SHARD), Task.claim_due(current_time, shard=SHARD)
 
-    for task in tasks:
-        wasLongen = task.update(current_time)
 
-        if wasLongen:
-            r.rpush('expired', json.dumps(task.to_dict()))
+def claim_due_from_timers(current_time: datetime):
+    retry_failed_timers()
+    # Ids without a document belong to deleted tasks. The Mongo claim stops two workers from
+    # sending the same item, and claim_due puts back popped ids that turn out not to be due
+    notification_ids = claim_due_timers(REDIS_TIMERS_REMINDERS, current_time)
+    task_ids = claim_due_timers(REDIS_TIMERS_DEADLINES, current_time)
+    return Notification.claim_due(current_time, ids=notification_ids), Task.claim_due(current_time, ids=task_ids)
+
+
+def process_due(current_time: datetime, claim):
+    started = time.perf_counter()
+    # Claimed items are already advanced in Mongo and belong to this worker only
+    reminded, extended = claim(current_time)
+    # A notification can outlive its task, e.g. one added while the task was deleted;
+    # it would keep firing until times_left runs out
+    reminded = Notification.drop_orphans(reminded)
+    claimed = time.perf_counter()
+
+    # Only ids and due times are queued, the bot loads the tasks' current fields when it renders.
+    # next and the deadline were already advanced, so step back to when each one fell due
+    reminders = [payload.encode(payload.EVENT_REMINDER, n._task_id, n.next - n.period) for n in reminded]
+    expired = [payload.encode(payload.EVENT_DEADLINE_EXPIRED, task._id, task.deadline - timedelta(days=1)) for task in extended]
+    encoded = time.perf_counter()
+
+    with r.pipeline(transaction=False) as pipe:
+        if QUEUE_MODE == "stream":
+            add_messages(pipe, REDIS_QUEUE_REMINDERS, reminders)
+            add_messages(pipe, REDIS_QUEUE_DEADLINES, expired)
+        else:
+            if reminders:
+                pipe.rpush(REDIS_QUEUE_REMINDERS, *reminders)
+            if expired:
+                pipe.rpush(REDIS_QUEUE_DEADLINES, *expired)
+        pipe.execute()
+    pushed = time.perf_counter()
+    NOTIFIER_TICK_SECONDS.observe(pushed - started)
+
+    if reminded or extended:
+        print(f"tick: claimed {len(reminded)} notifications, {len(extended)} tasks; "
+              f"pushed {len(reminders)} reminders, {len(expired)} expired; "
+              f"claim {(claimed - started) * 1000:.1f}ms, "
+              f"encode {(encoded - claimed) * 1000:.1f}ms, push {(pushed - encoded) * 1000:.1f}ms")
+
+
+def rebuild_until() -> datetime:
+    # Twice the interval, so a timer due later is refilled by a rebuild that still runs before it
+    return datetime.now() + timedelta(seconds=2 * NOTIFIER_REBUILD_INTERVAL)
+
+
+def get_next_due_times() -> list:
+    if NOTIFIER_TIMERS == "redis":
+        return [get_next_timer(REDIS_TIMERS_REMINDERS), get_next_timer(REDIS_TIMERS_DEADLINES)]
+
+    return [Notification.get_next_due_time(SHARD), Task.get_next_due_time(SHARD)]
+
+
+def seconds_until_next_due(current_time: datetime) -> float:
+    due_times = [t for t in get_next_due_times() if t != None]
+    if not due_times:
+        return NOTIFIER_MAX_SLEEP
+
+    return min(max((min(due_times) - current_time).total_seconds(), 0), NOTIFIER_MAX_SLEEP)
+
+
+def main():
+    try:
+        r.ping()
+        print("connected to redis")
+    except redis.exceptions.ConnectionError as e:
+        print(f'couldnot connect to redis: {e}')
+        exit()
+
+    ensure_indexes()
+    if connections.CONNECTIONS_WARM_UP:
+        connections.warm_up()
+    start_metrics_server(NOTIFIER_METRICS_PORT)
+
+    if NOTIFIER_TIMERS == "redis":
+        if REBUILDS_TIMERS:
+            rebuild_timers(rebuild_until())
+        claim = claim_due_from_timers
+    else:
+        if SHARD != None:
+            Notification.backfill_user_ids()
+        claim = claim_due
+
+    global _ticking
+    signal.signal(signal.SIGTERM, _stop)
+    rebuilt_at = time.monotonic()
+    while True:
+        _ticking = True
+        if claim == claim_due_from_timers and REBUILDS_TIMERS and time.monotonic() - rebuilt_at >= NOTIFIER_REBUILD_INTERVAL:
+            rebuild_timers(rebuild_until())
+            rebuilt_at = time.monotonic()
+        process_due(datetime.now(), claim)
+        _ticking = False
+        # At least once per NOTIFIER_MAX_SLEEP, a tick stuck on Mongo or Redis stops it
+        heartbeat()
+        if _stopping:
+            raise SystemExit(0)
+
+        # Handlers call wake_notifier() on inserts/edits, which ends this sleep early
+        wait_for_wakeup(seconds_until_next_due(datetime.now()))
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    finally:
+        connections.close()
@@ -0,0 +1,86 @@
+import json
+from datetime import datetime
+
+import msgpack
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+
+from mongo_api import Task
+from redis_api import REDIS_QUEUE_REMINDERS, REDIS_QUEUE_DEADLINES
+
+# Bump when the layout changes; consumers dead-letter versions they do not know
+PAYLOAD_VERSION = 1
+
+EVENT_REMINDER = 1
+EVENT_DEADLINE_EXPIRED = 2
+
+# JSON documents pushed before the binary format, told apart by the queue they came from
+LEGACY_QUEUE_EVENTS = {
+    REDIS_QUEUE_REMINDERS: EVENT_REMINDER,
+    REDIS_QUEUE_DEADLINES: EVENT_DEADLINE_EXPIRED,
+}
+
+
+class Event:
+    """A decoded queue message. task is set only for legacy messages, which carried the task's fields;
+    for the others the consumer loads the task by task_id right before rendering."""
+    __slots__ = ("event", "task_id", "due", "task")
+
+    def __init__(self, event: int, task_id: ObjectId, due: datetime, task: Task = None):
+        self.event = event
+        self.task_id = task_id
+        self.due = due
+        self.task = task
+
+
+def encode(event: int, task_id, due: datetime) -> bytes:
+    """[version, event, 12 byte task id, due timestamp], about 30 bytes a message.
+    Titles and deadlines are not copied in, so they are never stale when rendered."""
+    return msgpack.packb([PAYLOAD_VERSION, event, ObjectId(task_id).binary, due.timestamp()])
+
+
+def decode(queue: str, raw: bytes) -> Event:
+    """Raises ValueError for anything that is not a known payload."""
+    if raw[:1] == b"{":
+        return _decode_legacy(queue, raw)
+
+    try:
+        fields = msgpack.unpackb(raw)
+        version = fields[0]
+    except (msgpack.UnpackException, ValueError, TypeError, IndexError, KeyError) as e:
+        raise ValueError(f"not a payload: {e}")
+
+    if version != PAYLOAD_VERSION:
+        raise ValueError(f"unknown payload version {version!r}")
+
+    try:
+        _, event, task_id, due = fields
+        return Event(event, ObjectId(task_id), datetime.fromtimestamp(due))
+    except (ValueError, TypeError, InvalidId, OverflowError) as e:
+        raise ValueError(f"malformed v{version} payload: {e}")
+
+
+def _decode_legacy(queue: str, raw: bytes) -> Event:
+    try:
+        message_data = json.loads(raw)
+        task = Task(message_data["user_id"], message_data["title"], message_data.get("description"),
+                    datetime.fromisoformat(message_data["deadline"]))
+        # Legacy messages carry no task id; __init__ leaves the slot unset without one
+        task._id = None
+        due = message_data.get("due")
+        return Event(LEGACY_QUEUE_EVENTS[queue], None, datetime.fromisoformat(due) if due else None, task)
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError(f"malformed legacy message: {e}")
+
+
+def describe(raw: bytes) -> str:
+    """Human readable form for inspection tools."""
+    if raw[:1] == b"{":
+        return raw.decode('utf-8', errors='replace')
+
+    try:
+        fields = msgpack.unpackb(raw)
+        version, event, task_id, due = fields
+        return f"v{version} event={event} task={ObjectId(task_id)} due={datetime.fromtimestamp(due).isoformat()}"
+    except (msgpack.UnpackException, ValueError, TypeError, InvalidId, OverflowError):
+        return repr(raw)
@@ -0,0 +1,202 @@
+import asyncio
+import os
+import redis.exceptions
+from datetime import datetime
+
+from connections import Lazy, get_redis, get_async_redis
+
+REDIS_QUEUE_REMINDERS = "reminders"
+REDIS_QUEUE_DEADLINES = "expired"
+# reliable: lists with processing lists (reliable_queue.py), stream: consumer groups (stream_queue.py),
+# simple: lists popped and forgotten
+QUEUE_MODE = os.environ.get("QUEUE_MODE", "reliable")
+# Used by the reliable and stream consumers
+REDIS_QUEUE_RETRY = "queue:retry"
+REDIS_QUEUE_DEAD = "queue:dead"
+REDIS_NOTIFIER_WAKEUP = "notifier_wakeup"
+
+r = Lazy(get_redis)
+# Used by code running inside the bot's event loop
+async_r = Lazy(get_async_redis)
+
+
+def wake_notifier():
+    """Tells every sleeping notifier that due times have changed, so they recompute their sleep."""
+    try:
+        r.publish(REDIS_NOTIFIER_WAKEUP, 1)
+    except redis.exceptions.ConnectionError as e:
+        print(f"couldnot wake notifier: {e}")
+
+
+async def async_wake_notifier():
+    try:
+        await async_r.publish(REDIS_NOTIFIER_WAKEUP, 1)
+    except redis.exceptions.ConnectionError as e:
+        print(f"couldnot wake notifier: {e}")
+
+
+# Pub/sub rather than a list, so a wakeup reaches all notifier workers and not just one
+_wakeups = None
+
+
+def wait_for_wakeup(timeout: float):
+    """Blocks until wake_notifier() is called or timeout seconds pass."""
+    global _wakeups
+    if _wakeups == None:
+        _wakeups = r.pubsub(ignore_subscribe_messages=True)
+        _wakeups.subscribe(REDIS_NOTIFIER_WAKEUP)
+
+    if timeout <= 0:
+        return
+
+    if _wakeups.get_message(timeout=timeout) != None:
+        # Several wakeups during one sleep need only one tick
+        while _wakeups.get_message(timeout=0) != None:
+            pass
+
+
+REDIS_TIMERS_REMINDERS = "timers:reminders"
+REDIS_TIMERS_DEADLINES = "timers:deadlines"
+REDIS_TIMERS_CLAIM_LIMIT = 1000
+
+# Range + remove run as one script, so two notifiers never claim the same timer
+_claim_due = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+if #due > 0 then
+    redis.call('ZREM', KEYS[1], unpack(due))
+end
+return due
+"""
+_claim_due_script = None
+
+
+# Timers whose ZADD failed, put back by retry_failed_timers(); a timer that is never
+# scheduled never fires, since the notifier only looks at the timer sets
+_failed_timers = dict()
+# How often the bot retries its failed timers, the notifier does it every tick
+REDIS_TIMERS_RETRY_INTERVAL = 10
+
+
+def _record_failed(key: str, due_times: dict):
+    _failed_timers.setdefault(key, dict()).update({str(member_id): when for member_id, when in due_times.items()})
+
+
+def _forget_failed(key: str, member_ids):
+    # A later schedule or unschedule of the same timer wins over a failed one
+    failed = _failed_timers.get(key)
+    if failed:
+        for member_id in member_ids:
+            failed.pop(str(member_id), None)
+
+
+def schedule_timer(key: str, member_id, when: datetime):
+    try:
+        r.zadd(key, {str(member_id): when.timestamp()})
+        _forget_failed(key, [member_id])
+    except redis.exceptions.ConnectionError as e:
+        print(f"couldnot schedule timer {key}:{member_id}: {e}")
+        _record_failed(key, {member_id: when})
+
+
+def schedule_timers(key: str, due_times: dict, only_later: bool = False):
+    """Bulk version of schedule_timer, due_times maps member id to datetime.
+    only_later never moves an existing timer earlier, for due times that may be stale."""
+    if not due_times:
+        return
+
+    try:
+        r.zadd(key, {str(member_id): when.timestamp() for member_id, when in due_times.items()}, gt=only_later)
+        _forget_failed(key, due_times)
+    except redis.exceptions.ConnectionError as e:
+        print(f"couldnot schedule timers {key}: {e}")
+        _record_failed(key, due_times)
+
+
+def retry_failed_timers():
+    """Schedules again the timers this process failed to schedule. Plain ZADD: a failed
+    reschedule may have been to an earlier time, and a stale one only causes a spurious
+    pop, which claim_due puts back at the current time."""
+    for key in list(_failed_timers):
+        schedule_timers(key, _failed_timers.pop(key))
+
+
+def unschedule_timer(key: str, member_id):
+    _forget_failed(key, [member_id])
+    try:
+        r.zrem(key, str(member_id))
+    except redis.exceptions.ConnectionError as e:
+        print(f"couldnot unschedule timer {key}:{member_id}: {e}")
+
+
+def unschedule_timers(key: str, member_ids: list):
+    if not member_ids:
+        return
+
+    _forget_failed(key, member_ids)
+    try:
+        r.zrem(key, *[str(member_id) for member_id in member_ids])
+    except redis.exceptions.ConnectionError as e:
+        print(f"couldnot unschedule timers {key}: {e}")
+
+
+async def async_schedule_timer(key: str, member_id, when: datetime):
+    try:
+        await async_r.zadd(key, {str(member_id): when.timestamp()})
+        _forget_failed(key, [member_id])
+    except redis.exceptions.ConnectionError as e:
+        print(f"couldnot schedule timer {key}:{member_id}: {e}")
+        _record_failed(key, {member_id: when})
+
+
+async def run_timer_retries():
+    """Retries the bot's failed timers until cancelled."""
+    while True:
+        await asyncio.sleep(REDIS_TIMERS_RETRY_INTERVAL)
+        for key in list(_failed_timers):
+            due_times = _failed_timers.pop(key)
+            try:
+                await async_r.zadd(key, {member_id: when.timestamp() for member_id, when in due_times.items()})
+            except redis.exceptions.ConnectionError as e:
+                print(f"couldnot schedule timers {key}: {e}")
+                _record_failed(key, due_times)
+
+
+async def async_unschedule_timer(key: str, member_id):
+    _forget_failed(key, [member_id])
+    try:
+        await async_r.zrem(key, str(member_id))
+    except redis.exceptions.ConnectionError as e:
+        print(f"couldnot unschedule timer {key}:{member_id}: {e}")
+
+
+async def async_unschedule_timers(key: str, member_ids: list):
+    if not member_ids:
+        return
+
+    _forget_failed(key, member_ids)
+    try:
+        await async_r.zrem(key, *[str(member_id) for member_id in member_ids])
+    except redis.exceptions.ConnectionError as e:
+        print(f"couldnot unschedule timers {key}: {e}")
+
+
+def claim_due_timers(key: str, current_time: datetime) -> list:
+    """Atomically removes and returns ids of every timer due by current_time."""
+    global _claim_due_script
+    if _claim_due_script == None:
+        _claim_due_script = r.register_script(_claim_due)
+
+    claimed = list()
+    while True:
+        due = _claim_due_script(keys=[key], args=[current_time.timestamp(), REDIS_TIMERS_CLAIM_LIMIT])
+        claimed.extend(member.decode('utf-8') for member in due)
+        if len(due) < REDIS_TIMERS_CLAIM_LIMIT:
+            return claimed
+
+
+def get_next_timer(key: str):
+    first = r.zrange(key, 0, 0, withscores=True)
+    if not first:
+        return None
+
+    return datetime.fromtimestamp(first[0][1])
@@ -0,0 +1,194 @@
+import asyncio
+import base64
+import json
+import os
+import socket
+import time
+
+import redis.asyncio
+import redis.exceptions
+
+from redis_api import REDIS_QUEUE_RETRY, REDIS_QUEUE_DEAD
+
+# Stable ids let a restarted consumer take its own processing lists back right away
+QUEUE_CONSUMER_ID = os.environ.get("QUEUE_CONSUMER_ID", f"{socket.gethostname()}:{os.getpid()}")
+# Messages of a consumer that has not sent a heartbeat for this many seconds are redelivered
+QUEUE_VISIBILITY_TIMEOUT = int(os.environ.get("QUEUE_VISIBILITY_TIMEOUT", "60"))
+QUEUE_MAX_ATTEMPTS = 5
+QUEUE_RETRY_BASE = 5
+QUEUE_RETRY_MAX = 600
+QUEUE_RETRY_BATCH = 100
+
+REDIS_QUEUE_ATTEMPTS = "queue:attempts"
+REDIS_QUEUE_CONSUMERS = "queue:consumers"
+
+
+def processing_key(consumer_id: str, queue: str) -> str:
+    return f"queue:processing:{consumer_id}:{queue}"
+
+
+def heartbeat_key(consumer_id: str) -> str:
+    return f"queue:heartbeat:{consumer_id}"
+
+
+# Moves due retries back to their queue; one script, so two consumers never move the same one
+_requeue_due_retries = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, member in ipairs(due) do
+    local separator = string.find(member, "\\n", 1, true)
+    redis.call('RPUSH', string.sub(member, 1, separator - 1), string.sub(member, separator + 1))
+    redis.call('ZREM', KEYS[1], member)
+end
+return #due
+"""
+
+
+class Delivery:
+    """One queued message on its way to Telegram.
+
+    Whoever learns the outcome settles it with ack() or fail(). Without a consumer
+    (simple mode) both do nothing and the message is gone once popped."""
+    __slots__ = ("queue", "raw", "due", "consumer", "entry_id")
+
+    def __init__(self, queue: str, raw: bytes, consumer=None, entry_id: bytes = None):
+        self.queue = queue
+        self.raw = raw
+        # Stream entry id, None for list queues
+        self.entry_id = entry_id
+        # When the reminder fell due, for the lag metric
+        self.due = None
+        self.consumer = consumer
+
+    async def ack(self):
+        if self.consumer != None:
+            await self.consumer.ack(self)
+
+    async def fail(self, error: str, permanent: bool = False, delay: float = 0):
+        """Schedules a retry with backoff, or dead-letters the message if permanent or out of attempts."""
+        if self.consumer != None:
+            await self.consumer.fail(self, error, permanent, delay)
+
+
+def retry_entry(delivery: Delivery) -> bytes:
+    # Payloads are binary, so queue and message are joined rather than put in JSON
+    return delivery.queue.encode('utf-8') + b"\n" + delivery.raw
+
+
+def dead_letter(delivery: Delivery, error: str, attempts: int) -> str:
+    print(f"queue: dead-lettered message from {delivery.queue} after {attempts} attempts: {error}")
+    return json.dumps({
+        "queue": delivery.queue,
+        # Payloads are binary
+        "message": base64.b64encode(delivery.raw).decode('ascii'),
+        "error": error,
+        "attempts": attempts,
+        "failed_at": time.time(),
+    })
+
+
+class ReliableConsumer:
+    """Consumes queues with BLMOVE into per-consumer processing lists.
+
+    A message leaves its processing list only when acked, retried or dead-lettered.
+    Every consumer keeps a heartbeat and reaps the processing lists of consumers whose
+    heartbeat expired, so messages of a crashed process are delivered again."""
+
+    def __init__(self, redis: redis.asyncio.Redis, queues: list, handle, consumer_id: str = QUEUE_CONSUMER_ID,
+                 visibility_timeout: int = QUEUE_VISIBILITY_TIMEOUT, batch: int = 100):
+        self.redis = redis
+        self.queues = queues
+        # Coroutine taking a list of deliveries
+        self.handle = handle
+        self.consumer_id = consumer_id
+        self.visibility_timeout = visibility_timeout
+        self.batch = batch
+        self.requeue_due_retries = redis.register_script(_requeue_due_retries)
+
+    async def ack(self, delivery: Delivery):
+        try:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.lrem(processing_key(self.consumer_id, delivery.queue), 1, delivery.raw)
+                pipe.hdel(REDIS_QUEUE_ATTEMPTS, delivery.raw)
+                await pipe.execute()
+        except redis.exceptions.ConnectionError as e:
+            # It stays in the processing list and is sent again after a restart
+            print(f"queue: couldnot ack message from {delivery.queue}: {e}")
+
+    async def fail(self, delivery: Delivery, error: str, permanent: bool, delay: float):
+        try:
+            attempts = await self.redis.hincrby(REDIS_QUEUE_ATTEMPTS, delivery.raw, 1)
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.lrem(processing_key(self.consumer_id, delivery.queue), 1, delivery.raw)
+                if permanent or attempts >= QUEUE_MAX_ATTEMPTS:
+                    pipe.hdel(REDIS_QUEUE_ATTEMPTS, delivery.raw)
+                    pipe.lpush(REDIS_QUEUE_DEAD, dead_letter(delivery, error, attempts))
+                else:
+                    backoff = min(QUEUE_RETRY_BASE * 2 ** (attempts - 1), QUEUE_RETRY_MAX)
+                    pipe.zadd(REDIS_QUEUE_RETRY, {retry_entry(delivery): time.time() + max(backoff, delay)})
+                await pipe.execute()
+        except redis.exceptions.ConnectionError as e:
+            print(f"queue: couldnot retry message from {delivery.queue}: {e}")
+
+    async def _consume(self, queue: str):
+        # BLMOVE takes a single source, unlike BLPOP, so every queue gets its own loop blocking
+        # on its own pooled connection; an idle queue never holds up the other one
+        processing = processing_key(self.consumer_id, queue)
+        while True:
+            # The move is atomic, a message is always either in the queue or in a processing list
+            first = await self.redis.blmove(queue, processing, 0, "LEFT", "RIGHT")
+            batch = [first]
+
+            waiting = min(await self.redis.llen(queue), self.batch)
+            if waiting:
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    for _ in range(waiting):
+                        pipe.lmove(queue, processing, "LEFT", "RIGHT")
+                    batch.extend(raw for raw in await pipe.execute() if raw != None)
+
+            await self.handle([Delivery(queue, raw, self) for raw in batch])
+
+    async def _requeue(self, consumer_id: str) -> int:
+        """Puts a consumer's unacked messages back at the head of their queues, oldest first."""
+        moved = 0
+        for queue in self.queues:
+            while await self.redis.lmove(processing_key(consumer_id, queue), queue, "RIGHT", "LEFT") != None:
+                moved += 1
+
+        return moved
+
+    async def _heartbeat(self):
+        while True:
+            await self.redis.set(heartbeat_key(self.consumer_id), 1, ex=self.visibility_timeout)
+            await asyncio.sleep(self.visibility_timeout / 3)
+
+    async def _reap(self):
+        while True:
+            for member in await self.redis.smembers(REDIS_QUEUE_CONSUMERS):
+                consumer_id = member.decode('utf-8')
+                if consumer_id == self.consumer_id or await self.redis.exists(heartbeat_key(consumer_id)):
+                    continue
+
+                moved = await self._requeue(consumer_id)
+                await self.redis.srem(REDIS_QUEUE_CONSUMERS, consumer_id)
+                if moved:
+                    print(f"queue: redelivering {moved} messages of silent consumer {consumer_id}")
+
+            await asyncio.sleep(self.visibility_timeout)
+
+    async def _requeue_retries(self):
+        # Retries wait in a sorted set rather than in the consumer, so a backoff never blocks the loop
+        while True:
+            while await self.requeue_due_retries(keys=[REDIS_QUEUE_RETRY], args=[time.time(), QUEUE_RETRY_BATCH]) == QUEUE_RETRY_BATCH:
+                pass
+            await asyncio.sleep(1)
+
+    async def run(self):
+        # Anything left from a previous run under the same id was never acked
+        moved = await self._requeue(self.consumer_id)
+        if moved:
+            print(f"queue: redelivering {moved} unacked messages from the previous run")
+
+        await self.redis.set(heartbeat_key(self.consumer_id), 1, ex=self.visibility_timeout)
+        await self.redis.sadd(REDIS_QUEUE_CONSUMERS, self.consumer_id)
+        await asyncio.gather(self._heartbeat(), self._reap(), self._requeue_retries(),
+                             *(self._consume(queue) for queue in self.queues))
@@ -0,0 +1,150 @@
+import asyncio
+import time
+from collections import deque
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramRetryAfter, TelegramNetworkError, TelegramServerError
+
+from metrics import observe_lag
+
+# Telegram allows about 30 messages per second overall and about 1 per second to one chat
+SENDER_CONCURRENCY = 8
+SENDER_GLOBAL_RATE = 30
+SENDER_CHAT_RATE = 1
+SENDER_MAX_ATTEMPTS = 5
+SENDER_STATS_INTERVAL = 60
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def is_full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+    def pause(self, seconds: float):
+        """Empties the bucket for the given time, used when Telegram asks us to back off."""
+        self._refill()
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+    async def acquire(self):
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class Sender:
+    """Queues outgoing messages and sends them with bounded concurrency, within Telegram's
+    global and per-chat flood limits. Has the same send_message signature as Bot."""
+
+    def __init__(self, bot: Bot, concurrency: int = SENDER_CONCURRENCY, global_rate: float = SENDER_GLOBAL_RATE, chat_rate: float = SENDER_CHAT_RATE):
+        self.bot = bot
+        self.concurrency = concurrency
+        self.chat_rate = chat_rate
+        self.global_bucket = TokenBucket(global_rate, capacity=global_rate)
+        self.chat_buckets = dict()
+        # Bounded so a burst applies backpressure to the consumer instead of growing memory
+        self.queue = asyncio.Queue(maxsize=concurrency * 100)
+
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.latencies = deque(maxlen=1000)
+
+    async def send_message(self, chat_id: int, text: str, deliveries: list = ()):
+        """deliveries are the queued messages behind text, settled once the outcome is known."""
+        await self.queue.put((chat_id, text, deliveries))
+
+    async def drain(self):
+        """Waits until every queued message has been sent or given up on."""
+        await self.queue.join()
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket == None:
+            if len(self.chat_buckets) > 10000:
+                # Full buckets carry no state, drop them
+                self.chat_buckets = {k: v for k, v in self.chat_buckets.items() if not v.is_full()}
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate)
+
+        return bucket
+
+    async def _deliver(self, chat_id: int, text: str, deliveries: list):
+        for attempt in range(SENDER_MAX_ATTEMPTS):
+            await self._chat_bucket(chat_id).acquire()
+            await self.global_bucket.acquire()
+
+            started = time.perf_counter()
+            try:
+                await self.bot.send_message(chat_id, text)
+                self.latencies.append(time.perf_counter() - started)
+                self.sent += 1
+                observe_lag([delivery.due for delivery in deliveries if delivery.due != None])
+                for delivery in deliveries:
+                    await delivery.ack()
+                return
+            except TelegramRetryAfter as e:
+                self.retries += 1
+                # A flood wait applies to the whole bot, so every worker backs off
+                self.global_bucket.pause(e.retry_after)
+                await asyncio.sleep(e.retry_after)
+            except (TelegramNetworkError, TelegramServerError) as e:
+                # Transient, retried later from the queue instead of holding up this worker
+                print(f"sender: could not send to {chat_id}, will retry: {e}")
+                self.failed += 1
+                await self._fail(deliveries, str(e))
+                return
+            except TelegramAPIError as e:
+                print(f"sender: could not send to {chat_id}: {e}")
+                self.failed += 1
+                await self._fail(deliveries, str(e), permanent=True)
+                return
+
+        print(f"sender: giving up on {chat_id} after {SENDER_MAX_ATTEMPTS} attempts")
+        self.failed += 1
+        await self._fail(deliveries, "flood wait")
+
+    async def _fail(self, deliveries: list, error: str, permanent: bool = False):
+        for delivery in deliveries:
+            await delivery.fail(error, permanent)
+
+    async def _worker(self):
+        while True:
+            chat_id, text, deliveries = await self.queue.get()
+            try:
+                await self._deliver(chat_id, text, deliveries)
+            finally:
+                self.queue.task_done()
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(SENDER_STATS_INTERVAL)
+            if self.latencies:
+                print("sender:", self.stats())
+
+    def stats(self) -> dict:
+        latencies = sorted(self.latencies)
+        return {
+            "sent": self.sent,
+            "failed": self.failed,
+            "retries": self.retries,
+            "queued": self.queue.qsize(),
+            "latency_avg_ms": round(sum(latencies) / len(latencies) * 1000, 1) if latencies else None,
+            "latency_p95_ms": round(latencies[int(len(latencies) * 0.95)] * 1000, 1) if latencies else None,
+        }
+
+    async def run(self):
+        await asyncio.gather(self._report(), *(self._worker() for _ in range(self.concurrency)))
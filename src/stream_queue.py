@@ -0,0 +1,190 @@
+import asyncio
+import time
+
+import redis.asyncio
+import redis.exceptions
+
+from redis_api import REDIS_QUEUE_DEAD
+from reliable_queue import Delivery, dead_letter, heartbeat_key, QUEUE_CONSUMER_ID, QUEUE_VISIBILITY_TIMEOUT, QUEUE_MAX_ATTEMPTS
+
+REDIS_STREAM_GROUP = "bot"
+# Entries older than this are trimmed on XADD, acked or not
+REDIS_STREAM_RETENTION = 24 * 60 * 60
+# Consumers idle this long with nothing pending are dropped from the group
+REDIS_STREAM_CONSUMER_EXPIRY = 24 * 60 * 60
+
+
+def stream_key(queue: str) -> str:
+    return f"stream:{queue}"
+
+
+def add_messages(pipe, queue: str, messages: list):
+    """Queues XADDs on a sync or async pipeline, trimming entries past the retention."""
+    min_id = int((time.time() - REDIS_STREAM_RETENTION) * 1000)
+    for message in messages:
+        pipe.xadd(stream_key(queue), {"data": message}, minid=min_id, approximate=True)
+
+
+class StreamConsumer:
+    """Consumes the queues' streams as a member of one consumer group.
+
+    Any number of bot processes can share the group; each entry goes to one of them
+    and stays pending until acked. Every consumer keeps a heartbeat, as in
+    reliable_queue.py. Entries are claimed again once they were idle for the visibility
+    timeout and either their consumer's heartbeat expired or the send failed; entries
+    a live consumer still holds in the digester or sender are left alone, however long
+    a burst keeps them there. They are dead-lettered once delivered QUEUE_MAX_ATTEMPTS times."""
+
+    def __init__(self, redis: redis.asyncio.Redis, queues: list, handle, consumer_id: str = QUEUE_CONSUMER_ID,
+                 visibility_timeout: int = QUEUE_VISIBILITY_TIMEOUT, batch: int = 100):
+        self.redis = redis
+        self.queues = {stream_key(queue): queue for queue in queues}
+        # Coroutine taking a list of deliveries
+        self.handle = handle
+        self.consumer_id = consumer_id
+        self.visibility_timeout = visibility_timeout
+        self.batch = batch
+        # Own entries whose send failed transiently, retried by the reclaim loop
+        self.failed = set()
+
+    async def ack(self, delivery: Delivery):
+        try:
+            await self.redis.xack(stream_key(delivery.queue), REDIS_STREAM_GROUP, delivery.entry_id)
+        except redis.exceptions.ConnectionError as e:
+            # It stays pending and is claimed again after the visibility timeout
+            print(f"queue: couldnot ack message from {delivery.queue}: {e}")
+
+    async def fail(self, delivery: Delivery, error: str, permanent: bool, delay: float):
+        if not permanent:
+            # Left pending, the reclaim loop retries it once it has been idle long enough
+            self.failed.add(delivery.entry_id)
+            return
+
+        try:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.lpush(REDIS_QUEUE_DEAD, dead_letter(delivery, error, 1))
+                pipe.xack(stream_key(delivery.queue), REDIS_STREAM_GROUP, delivery.entry_id)
+                await pipe.execute()
+        except redis.exceptions.ConnectionError as e:
+            print(f"queue: couldnot dead-letter message from {delivery.queue}: {e}")
+
+    async def _create_groups(self):
+        for stream in self.queues:
+            try:
+                # "0": entries the notifier added before the first bot started are read too
+                await self.redis.xgroup_create(stream, REDIS_STREAM_GROUP, id="0", mkstream=True)
+            except redis.exceptions.ResponseError as e:
+                if "BUSYGROUP" not in str(e):
+                    raise
+
+    async def _handle_entries(self, stream: bytes, entries: list):
+        queue = self.queues[stream.decode('utf-8')]
+        deliveries = list()
+        for entry_id, fields in entries:
+            # Trimmed while pending
+            if not fields:
+                await self.redis.xack(stream, REDIS_STREAM_GROUP, entry_id)
+                continue
+
+            deliveries.append(Delivery(queue, fields[b"data"], self, entry_id))
+
+        if deliveries:
+            await self.handle(deliveries)
+
+    async def _consume(self):
+        # "0" first: entries this consumer id read before a restart and never acked
+        for stream, entries in await self.redis.xreadgroup(REDIS_STREAM_GROUP, self.consumer_id, {stream: "0" for stream in self.queues}):
+            await self._handle_entries(stream, entries)
+
+        streams = {stream: ">" for stream in self.queues}
+        while True:
+            for stream, entries in await self.redis.xreadgroup(REDIS_STREAM_GROUP, self.consumer_id, streams, count=self.batch, block=0):
+                await self._handle_entries(stream, entries)
+
+    async def _dead_consumers(self, names: set) -> set:
+        names = list(names)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for name in names:
+                pipe.exists(heartbeat_key(name))
+            alive = await pipe.execute()
+        return {name for name, exists in zip(names, alive) if not exists}
+
+    async def _reclaim_stream(self, stream: str):
+        idle_ms = self.visibility_timeout * 1000
+        pending = await self.redis.xpending_range(stream, REDIS_STREAM_GROUP, min="-", max="+", count=self.batch, idle=idle_ms)
+        if not pending:
+            return
+
+        for entry in pending:
+            if isinstance(entry["consumer"], bytes):
+                entry["consumer"] = entry["consumer"].decode('utf-8')
+        dead = await self._dead_consumers({entry["consumer"] for entry in pending if entry["consumer"] != self.consumer_id})
+        # Idle only means delivered a while ago, the owner may still be about to send it
+        pending = [entry for entry in pending if entry["consumer"] in dead
+                   or (entry["consumer"] == self.consumer_id and entry["message_id"] in self.failed)]
+        if not pending:
+            return
+
+        deliveries = {entry["message_id"]: entry["times_delivered"] for entry in pending}
+        self.failed.difference_update(deliveries)
+        # XCLAIM rechecks the idle time, so of two consumers reclaiming at once only one gets an entry
+        claimed = await self.redis.xclaim(stream, REDIS_STREAM_GROUP, self.consumer_id, idle_ms, list(deliveries))
+        retried = list()
+        queue = self.queues[stream]
+        for entry_id, fields in claimed:
+            if fields and deliveries[entry_id] >= QUEUE_MAX_ATTEMPTS:
+                raw = fields[b"data"]
+                async with self.redis.pipeline(transaction=True) as pipe:
+                    pipe.lpush(REDIS_QUEUE_DEAD, dead_letter(Delivery(queue, raw), "not acked", deliveries[entry_id]))
+                    pipe.xack(stream, REDIS_STREAM_GROUP, entry_id)
+                    await pipe.execute()
+            else:
+                retried.append((entry_id, fields))
+
+        if retried:
+            print(f"queue: redelivering {len(retried)} pending messages from {stream}")
+            await self._handle_entries(stream.encode('utf-8'), retried)
+
+    async def _expire_consumers(self, stream: str):
+        for consumer in await self.redis.xinfo_consumers(stream, REDIS_STREAM_GROUP):
+            name = consumer["name"]
+            if isinstance(name, bytes):
+                name = name.decode('utf-8')
+            if name != self.consumer_id and consumer["pending"] == 0 and consumer["idle"] > REDIS_STREAM_CONSUMER_EXPIRY * 1000:
+                await self.redis.xgroup_delconsumer(stream, REDIS_STREAM_GROUP, name)
+
+    async def _heartbeat(self):
+        while True:
+            await self.redis.set(heartbeat_key(self.consumer_id), 1, ex=self.visibility_timeout)
+            await asyncio.sleep(self.visibility_timeout / 3)
+
+    async def _reclaim(self):
+        while True:
+            await asyncio.sleep(self.visibility_timeout / 2)
+            for stream in self.queues:
+                await self._reclaim_stream(stream)
+                await self._expire_consumers(stream)
+
+    async def run(self):
+        await self._create_groups()
+        await self.redis.set(heartbeat_key(self.consumer_id), 1, ex=self.visibility_timeout)
+        await asyncio.gather(self._heartbeat(), self._consume(), self._reclaim())
+
+
+def group_info(r, queue: str) -> dict:
+    """XINFO for the bot's group on a queue's stream: length, backlog and per-consumer pending/idle."""
+    stream = stream_key(queue)
+    if not r.exists(stream):
+        return {"length": 0, "lag": 0, "pending": 0, "consumers": []}
+
+    groups = [group for group in r.xinfo_groups(stream) if group["name"] in (REDIS_STREAM_GROUP, REDIS_STREAM_GROUP.encode())]
+    if not groups:
+        return {"length": r.xlen(stream), "lag": None, "pending": 0, "consumers": []}
+
+    return {
+        "length": r.xlen(stream),
+        # Entries not yet read by any consumer, reported by Redis 7+
+        "lag": groups[0].get("lag"),
+        "pending": groups[0]["pending"],
+        "consumers": r.xinfo_consumers(stream, REDIS_STREAM_GROUP),
+    }
@@ -0,0 +1,188 @@
+"""Runs N bot workers and M notifier workers, restarts them when they crash or stop
+answering health checks, and drains them on SIGTERM.
+
+    python supervisor.py --bots 4 --notifiers 2 --cpu-affinity auto
+
+Each worker gets its own metrics port, counted up from --metrics-port, and a heartbeat
+file its main loop rewrites; a worker whose file goes stale is hung and gets killed and
+restarted. Several bots need webhook mode; bot i then listens on WEBHOOK_PORT + i,
+all behind one reverse proxy. Notifier j gets NOTIFIER_SHARDS=M and NOTIFIER_SHARD=j.
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SUPERVISOR_CHECK_INTERVAL = 1
+# A worker that just started gets this long before its heartbeat counts
+SUPERVISOR_HEALTH_GRACE = 30
+# Bots beat every few seconds from their event loop, notifiers once per tick,
+# which is at least once per NOTIFIER_MAX_SLEEP (60s)
+SUPERVISOR_BOT_HEARTBEAT_TIMEOUT = 30
+SUPERVISOR_NOTIFIER_HEARTBEAT_TIMEOUT = 180
+SUPERVISOR_BACKOFF_MIN = 1
+SUPERVISOR_BACKOFF_MAX = 60
+# A worker that ran this long before exiting restarts without backoff
+SUPERVISOR_STABLE_AFTER = 60
+# Bots flush their send queues on SIGTERM, give them a little longer than their own drain timeout
+SUPERVISOR_DRAIN_TIMEOUT = 30
+
+
+class Worker:
+    def __init__(self, name: str, script: str, env: dict, heartbeat_timeout: float, cpus: set = None):
+        self.name = name
+        self.script = script
+        self.heartbeat_file = os.path.join(tempfile.gettempdir(), f"taskmanager-{os.getpid()}-{name}.heartbeat")
+        self.env = {**env, "WORKER_HEARTBEAT_FILE": self.heartbeat_file}
+        self.heartbeat_timeout = heartbeat_timeout
+        self.cpus = cpus
+        self.process = None
+        self.started_at = 0
+        self.restart_at = 0
+        self.backoff = SUPERVISOR_BACKOFF_MIN
+
+    def start(self):
+        # A fresh file, so the previous process's last beat does not count
+        with open(self.heartbeat_file, "w"):
+            pass
+        # start_new_session: Ctrl+C reaches only the supervisor, which then drains the workers
+        self.process = subprocess.Popen([sys.executable, os.path.join(SRC_DIR, self.script)], cwd=SRC_DIR,
+                                        env={**os.environ, **self.env}, start_new_session=True)
+        if self.cpus and hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(self.process.pid, self.cpus)
+
+        self.started_at = time.monotonic()
+        print(f"supervisor: started {self.name} (pid {self.process.pid}{f', cpus {sorted(self.cpus)}' if self.cpus else ''})")
+
+    def _heartbeat_age(self) -> float:
+        try:
+            return time.time() - os.path.getmtime(self.heartbeat_file)
+        except OSError:
+            return float("inf")
+
+    def check(self, now: float):
+        if self.process == None:
+            if now >= self.restart_at:
+                self.start()
+            return
+
+        code = self.process.poll()
+        if code != None:
+            ran = now - self.started_at
+            if ran >= SUPERVISOR_STABLE_AFTER:
+                self.backoff = SUPERVISOR_BACKOFF_MIN
+            self.restart_at = now + self.backoff
+            self.process = None
+            print(f"supervisor: {self.name} exited with {code} after {ran:.0f}s, restarting in {self.backoff}s")
+            self.backoff = min(self.backoff * 2, SUPERVISOR_BACKOFF_MAX)
+            return
+
+        if now - self.started_at < SUPERVISOR_HEALTH_GRACE:
+            return
+
+        age = self._heartbeat_age()
+        if age > self.heartbeat_timeout:
+            # Hung rather than crashed, a SIGTERM might not be handled either
+            print(f"supervisor: {self.name} sent no heartbeat for {age:.0f}s, killing it")
+            self.process.kill()
+
+    def stop(self):
+        if self.process != None and self.process.poll() == None:
+            self.process.terminate()
+
+
+def parse_cpus(value: str) -> list:
+    """"none", "auto" for every core, or a list like "0-3,6"."""
+    if value == "none":
+        return list()
+    if value == "auto":
+        return sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+
+    cpus = list()
+    for part in value.split(","):
+        first, _, last = part.partition("-")
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def create_workers(args) -> list:
+    cpus = parse_cpus(args.cpu_affinity)
+    webhook_port = int(os.environ.get("WEBHOOK_PORT", "8080"))
+
+    workers = list()
+    for i in range(args.bots):
+        workers.append((f"bot-{i}", "main.py", {"WEBHOOK_PORT": str(webhook_port + i)}, "BOT_METRICS_PORT", SUPERVISOR_BOT_HEARTBEAT_TIMEOUT))
+    for j in range(args.notifiers):
+        workers.append((f"notifier-{j}", "notifier.py", {"NOTIFIER_SHARDS": str(args.notifiers), "NOTIFIER_SHARD": str(j)}, "NOTIFIER_METRICS_PORT",
+                        SUPERVISOR_NOTIFIER_HEARTBEAT_TIMEOUT))
+
+    result = list()
+    for index, (name, script, env, metrics_variable, heartbeat_timeout) in enumerate(workers):
+        env[metrics_variable] = str(args.metrics_port + index if args.metrics_port else 0)
+        # Round robin, one core per worker
+        worker_cpus = {cpus[index % len(cpus)]} if cpus else None
+        result.append(Worker(name, script, env, heartbeat_timeout, worker_cpus))
+
+    return result
+
+
+def run(workers: list):
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while not stopping:
+        now = time.monotonic()
+        for worker in workers:
+            worker.check(now)
+        time.sleep(SUPERVISOR_CHECK_INTERVAL)
+
+    print("supervisor: draining workers")
+    for worker in workers:
+        worker.stop()
+
+    deadline = time.monotonic() + SUPERVISOR_DRAIN_TIMEOUT
+    for worker in workers:
+        if worker.process == None:
+            continue
+        try:
+            worker.process.wait(timeout=max(deadline - time.monotonic(), 0))
+        except subprocess.TimeoutExpired:
+            print(f"supervisor: {worker.name} did not stop in time, killing it")
+            worker.process.kill()
+            worker.process.wait()
+
+    for worker in workers:
+        if os.path.exists(worker.heartbeat_file):
+            os.remove(worker.heartbeat_file)
+    print("supervisor: all workers stopped")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bots", type=int, default=int(os.environ.get("SUPERVISOR_BOTS", "1")))
+    parser.add_argument("--notifiers", type=int, default=int(os.environ.get("SUPERVISOR_NOTIFIERS", "1")))
+    parser.add_argument("--metrics-port", type=int, default=int(os.environ.get("SUPERVISOR_METRICS_PORT", "9100")),
+                        help="first worker metrics port, 0 disables the endpoints")
+    parser.add_argument("--cpu-affinity", default=os.environ.get("SUPERVISOR_CPU_AFFINITY", "none"),
+                        help='"none", "auto" to pin workers round robin over all cores, or cores like "0-3,6"')
+    args = parser.parse_args()
+
+    # Telegram allows one getUpdates poller per bot token
+    if args.bots > 1 and os.environ.get("BOT_MODE", "polling") != "webhook":
+        parser.error("several bots need BOT_MODE=webhook")
+    # Checked here too, otherwise every bot exits at once and is restarted forever
+    if os.environ.get("BOT_MODE", "polling") == "webhook" and not os.environ.get("WEBHOOK_SECRET") and os.environ.get("WEBHOOK_INSECURE", "0") != "1":
+        parser.error("webhook mode needs WEBHOOK_SECRET, or WEBHOOK_INSECURE=1 to run without one")
+
+    run(create_workers(args))
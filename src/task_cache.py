@@ -0,0 +1,135 @@
+import time
+from collections import OrderedDict
+
+import redis.exceptions
+
+from redis_api import r, async_r
+
+TASK_CACHE_SIZE = 10000
+# Bounds how stale an entry can get if an invalidation message is lost
+TASK_CACHE_TTL = 30
+REDIS_TASK_CACHE_INVALIDATE = "task_cache:invalidate"
+
+
+class LRUCache:
+    """LRU cache whose entries also expire after ttl seconds.
+
+    version grows on every invalidation; put() is skipped when it changed since the
+    caller started its query, so a result read before a write never gets cached after it."""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry == None or entry[0] < time.monotonic():
+            self.entries.pop(key, None)
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, value, version: int):
+        if version != self.version:
+            return
+
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, key):
+        self.version += 1
+        self.entries.pop(key, None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+        }
+
+
+cache = LRUCache(TASK_CACHE_SIZE, TASK_CACHE_TTL)
+
+
+def task_key(task_id) -> str:
+    return f"task:{task_id}"
+
+
+def user_key(user_id) -> str:
+    return f"user:{user_id}"
+
+
+def get(key):
+    """Returns the cached task document or list of documents, None on a miss."""
+    return cache.get(key)
+
+
+def put(key, value, version: int):
+    cache.put(key, value, version)
+
+
+def version() -> int:
+    return cache.version
+
+
+def calendar_key(user_id) -> str:
+    """One entry per user mapping (year, month) to that month's per-day task counts."""
+    return f"calendar:{user_id}"
+
+
+def _keys(task_ids: list, user_ids: list) -> list:
+    user_ids = set(user_ids)
+    return ([task_key(task_id) for task_id in task_ids] + [user_key(user_id) for user_id in user_ids]
+            + [calendar_key(user_id) for user_id in user_ids])
+
+
+def invalidate(task_ids: list, user_ids: list):
+    """Drops the entries here and tells the other processes to drop them too."""
+    keys = _keys(task_ids, user_ids)
+    for key in keys:
+        cache.invalidate(key)
+
+    if keys:
+        try:
+            r.publish(REDIS_TASK_CACHE_INVALIDATE, " ".join(keys))
+        except redis.exceptions.ConnectionError as e:
+            print(f"couldnot publish cache invalidation: {e}")
+
+
+async def async_invalidate(task_ids: list, user_ids: list):
+    keys = _keys(task_ids, user_ids)
+    for key in keys:
+        cache.invalidate(key)
+
+    if keys:
+        try:
+            await async_r.publish(REDIS_TASK_CACHE_INVALIDATE, " ".join(keys))
+        except redis.exceptions.ConnectionError as e:
+            print(f"couldnot publish cache invalidation: {e}")
+
+
+async def listen_invalidations():
+    """Applies invalidations published by other bot replicas and the notifier."""
+    async with async_r.pubsub(ignore_subscribe_messages=True) as pubsub:
+        await pubsub.subscribe(REDIS_TASK_CACHE_INVALIDATE)
+        async for message in pubsub.listen():
+            if message == None or message["type"] != "message":
+                continue
+
+            for key in message["data"].decode('utf-8').split():
+                cache.invalidate(key)
+
+
+def stats() -> dict:
+    return cache.stats()
@@ -0,0 +1,121 @@
+"""Sender and Digester against fake_telegram.py, through a real Bot and HTTP session."""
+import asyncio
+import time
+import unittest
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiohttp.test_utils import TestServer
+
+from digest import Digester
+from fake_telegram import FakeTelegram, create_app
+from sender import Sender
+
+
+class RecordingDelivery:
+    """Stands in for a queued message and records how it was settled."""
+
+    def __init__(self):
+        self.due = None
+        self.outcome = None
+        self.settled_at = None
+
+    async def ack(self):
+        self.outcome = "ack"
+        self.settled_at = time.monotonic()
+
+    async def fail(self, error: str, permanent: bool = False, delay: float = 0):
+        self.outcome = "permanent" if permanent else "retry"
+        self.settled_at = time.monotonic()
+
+
+class FakeTelegramTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.fake = FakeTelegram()
+        self.server = TestServer(create_app(self.fake))
+        await self.server.start_server()
+        self.addAsyncCleanup(self.server.close)
+
+        session = AiohttpSession(api=TelegramAPIServer.from_base(str(self.server.make_url("")).rstrip("/")))
+        self.bot = Bot(token="42:TEST", session=session)
+        self.addAsyncCleanup(self.bot.session.close)
+
+        self.sender = Sender(self.bot, concurrency=2)
+        running = asyncio.create_task(self.sender.run())
+        self.addCleanup(running.cancel)
+
+    def sent(self) -> list:
+        return [call["params"] for call in self.fake.calls if call["method"] == "sendMessage"]
+
+    async def test_sends(self):
+        delivery = RecordingDelivery()
+        await self.sender.send_message(100, "hello", [delivery])
+        await self.sender.drain()
+
+        self.assertEqual(delivery.outcome, "ack")
+        self.assertEqual([(params["chat_id"], params["text"]) for params in self.sent()], [("100", "hello")])
+
+    async def test_retry_after_pauses_every_chat(self):
+        self.fake.fail_next(100, 429, "Too Many Requests: retry after 1", retry_after=1)
+        limited, other = RecordingDelivery(), RecordingDelivery()
+        await self.sender.send_message(100, "first", [limited])
+        while self.sender.retries == 0:
+            await asyncio.sleep(0.01)
+        flood_wait = time.monotonic()
+
+        # Another chat, queued during the flood wait, waits it out too
+        await self.sender.send_message(200, "second", [other])
+        await self.sender.drain()
+
+        self.assertEqual((limited.outcome, other.outcome), ("ack", "ack"))
+        self.assertGreaterEqual(other.settled_at - flood_wait, 0.9)
+        self.assertCountEqual([params["chat_id"] for params in self.sent()], ["100", "100", "200"])
+
+    async def test_permanent_failure(self):
+        self.fake.fail_next(100, 403, "Forbidden: bot was blocked by the user")
+        delivery = RecordingDelivery()
+        await self.sender.send_message(100, "hello", [delivery])
+        await self.sender.drain()
+
+        self.assertEqual(delivery.outcome, "permanent")
+        self.assertEqual(self.sender.failed, 1)
+
+    async def test_server_error_is_retried_later(self):
+        self.fake.fail_next(100, 500, "Internal Server Error")
+        delivery = RecordingDelivery()
+        await self.sender.send_message(100, "hello", [delivery])
+        await self.sender.drain()
+
+        self.assertEqual(delivery.outcome, "retry")
+        # Not retried in place, the queue redelivers it
+        self.assertEqual(len(self.sent()), 1)
+
+    async def test_digest_settles_every_message(self):
+        digester = Digester(self.sender, window=0.05)
+        deliveries = [RecordingDelivery(), RecordingDelivery()]
+        await digester.send_message(100, "one", deliveries[:1])
+        await digester.send_message(100, "two", deliveries[1:])
+        await digester.drain()
+        await self.sender.drain()
+
+        self.assertEqual([delivery.outcome for delivery in deliveries], ["ack", "ack"])
+        texts = [params["text"] for params in self.sent()]
+        self.assertEqual(len(texts), 1)
+        self.assertIn("one", texts[0])
+        self.assertIn("two", texts[0])
+
+    async def test_digest_failure_fails_every_message(self):
+        self.fake.fail_next(100, 403, "Forbidden: bot was blocked by the user")
+        digester = Digester(self.sender, window=0.05)
+        deliveries = [RecordingDelivery(), RecordingDelivery()]
+        await digester.send_message(100, "one", deliveries[:1])
+        await digester.send_message(100, "two", deliveries[1:])
+        await digester.drain()
+        await self.sender.drain()
+
+        self.assertEqual([delivery.outcome for delivery in deliveries], ["permanent", "permanent"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+from fsm_storage import SharedRedisStorage, dumps, loads
+
+
+class FsmDataTest(unittest.TestCase):
+    def test_round_trip(self):
+        data = {
+            "title": "report",
+            "deadline": datetime(2026, 1, 2, 12, 30, 15, 250000),
+            "reminder_time": timedelta(hours=1, minutes=30),
+        }
+        self.assertEqual(loads(dumps(data)), data)
+
+    def test_nested_values(self):
+        data = {"reminders": [{"before": timedelta(days=1)}, {"before": timedelta(minutes=5)}],
+                "history": {"created": datetime(2026, 1, 1), "count": 2}}
+        self.assertEqual(loads(dumps(data)), data)
+
+    def test_compact(self):
+        self.assertEqual(dumps({"period": timedelta(seconds=90)}), '{"period":{"$td":90.0}}')
+
+    def test_plain_object_with_marker_key(self):
+        # Only a one-key object is taken for an encoded value
+        data = {"$dt": 5, "other": 1}
+        self.assertEqual(loads(dumps(data)), data)
+
+    def test_unsupported_type(self):
+        with self.assertRaises(TypeError):
+            dumps({"tags": {"a", "b"}})
+
+
+class SharedRedisStorageTest(unittest.IsolatedAsyncioTestCase):
+    async def test_close_keeps_the_shared_client(self):
+        client = mock.AsyncMock()
+        await SharedRedisStorage(client).close()
+        client.aclose.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+"""Queue messages written before the binary payload must still reach the user. Run from src/:
+
+    python -m unittest discover tests
+"""
+import json
+import unittest
+from datetime import datetime, timedelta
+
+from bson.objectid import ObjectId
+
+import payload
+from main import handle_messages
+from redis_api import REDIS_QUEUE_REMINDERS, REDIS_QUEUE_DEADLINES
+from reliable_queue import Delivery
+
+DEADLINE = datetime(2026, 1, 2, 12, 0)
+
+
+class RecordingNotificator:
+    def __init__(self):
+        self.sent = list()
+
+    async def send_message(self, chat_id: int, text: str, deliveries: list = ()):
+        self.sent.append((chat_id, text, deliveries))
+
+
+def legacy_reminder() -> bytes:
+    # What the notifier pushed to the reminders queue before the binary payload
+    return json.dumps({
+        "next": (DEADLINE - timedelta(hours=1)).isoformat(),
+        "due": (DEADLINE - timedelta(hours=2)).isoformat(),
+        "period_sec": 3600.0,
+        "deadline": DEADLINE.isoformat(),
+        "times_left": 2,
+        "user_id": 42,
+        "title": "Report",
+        "description": None,
+    }).encode('utf-8')
+
+
+def legacy_deadline() -> bytes:
+    # And to the deadlines queue
+    return json.dumps({"user_id": 42, "title": "Report", "description": "draft", "deadline": DEADLINE.isoformat()}).encode('utf-8')
+
+
+class LegacyPayloadTest(unittest.TestCase):
+    def test_decode_reminder(self):
+        event = payload.decode(REDIS_QUEUE_REMINDERS, legacy_reminder())
+        self.assertEqual(event.event, payload.EVENT_REMINDER)
+        self.assertEqual(event.due, DEADLINE - timedelta(hours=2))
+        self.assertEqual((event.task._id, event.task.user_id, event.task.deadline), (None, 42, DEADLINE))
+
+    def test_decode_deadline(self):
+        event = payload.decode(REDIS_QUEUE_DEADLINES, legacy_deadline())
+        self.assertEqual(event.event, payload.EVENT_DEADLINE_EXPIRED)
+        self.assertEqual(event.due, None)
+        self.assertEqual((event.task._id, event.task.title), (None, "Report"))
+
+    def test_decode_current(self):
+        task_id = ObjectId()
+        event = payload.decode(REDIS_QUEUE_REMINDERS, payload.encode(payload.EVENT_REMINDER, task_id, DEADLINE))
+        self.assertEqual((event.event, event.task_id, event.due, event.task), (payload.EVENT_REMINDER, task_id, DEADLINE, None))
+
+
+class LegacyRenderTest(unittest.IsolatedAsyncioTestCase):
+    async def render(self, queue: str, raw: bytes) -> list:
+        notificator = RecordingNotificator()
+        # Legacy events carry their task, so no query is made
+        await handle_messages([Delivery(queue, raw)], notificator)
+        return notificator.sent
+
+    async def test_render_reminder(self):
+        sent = await self.render(REDIS_QUEUE_REMINDERS, legacy_reminder())
+        self.assertEqual(len(sent), 1)
+        self.assertEqual(sent[0][0], 42)
+        self.assertIn("Remind you about your deadline", sent[0][1])
+        self.assertIn(DEADLINE.isoformat(), sent[0][1])
+
+    async def test_render_deadline(self):
+        sent = await self.render(REDIS_QUEUE_DEADLINES, legacy_deadline())
+        self.assertEqual(len(sent), 1)
+        self.assertEqual(sent[0][0], 42)
+        self.assertIn("You missed your task", sent[0][1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+from unittest import mock
+
+from sender import TokenBucket
+
+
+class TokenBucketTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.slept = list()
+        # Only sender's own references, the event loop keeps the real clock
+        patcher = mock.patch("sender.time", mock.Mock(monotonic=lambda: self.now))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def sleep(self, seconds: float):
+        # Stands in for asyncio.sleep, moving the bucket's clock instead of waiting
+        self.slept.append(seconds)
+        self.now += seconds
+
+    async def acquire(self, bucket: TokenBucket):
+        with mock.patch("sender.asyncio", mock.Mock(sleep=self.sleep)):
+            await bucket.acquire()
+
+    async def test_starts_full(self):
+        bucket = TokenBucket(rate=10, capacity=3)
+        for _ in range(3):
+            await self.acquire(bucket)
+        self.assertEqual(self.slept, [])
+
+    async def test_waits_for_refill(self):
+        bucket = TokenBucket(rate=2, capacity=1)
+        await self.acquire(bucket)
+        await self.acquire(bucket)
+        self.assertAlmostEqual(sum(self.slept), 0.5)
+
+    def test_refill_is_capped(self):
+        bucket = TokenBucket(rate=10, capacity=5)
+        bucket.tokens = 0
+        self.now += 100
+        self.assertTrue(bucket.is_full())
+        self.assertEqual(bucket.tokens, 5)
+
+    async def test_pause_blocks_for_the_given_time(self):
+        # A rate of 4 keeps the fake clock's arithmetic exact
+        bucket = TokenBucket(rate=4, capacity=4)
+        bucket.pause(2)
+        await self.acquire(bucket)
+        # Empty for 2 seconds, then one token's worth of refill
+        self.assertEqual(sum(self.slept), 2 + 1 / 4)
+
+    def test_pause_keeps_debt(self):
+        bucket = TokenBucket(rate=1, capacity=1)
+        bucket.tokens = -1
+        bucket.pause(3)
+        self.assertEqual(bucket.tokens, -4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,27 @@
+import os
+import unittest
+from unittest import mock
+
+from supervisor import parse_cpus
+
+
+class ParseCpusTest(unittest.TestCase):
+    def test_none(self):
+        self.assertEqual(parse_cpus("none"), [])
+
+    def test_list_and_ranges(self):
+        self.assertEqual(parse_cpus("0-3,6"), [0, 1, 2, 3, 6])
+        self.assertEqual(parse_cpus("5"), [5])
+
+    @unittest.skipUnless(hasattr(os, "sched_getaffinity"), "needs sched_getaffinity")
+    def test_auto_uses_affinity(self):
+        with mock.patch("supervisor.os.sched_getaffinity", return_value={3, 1, 2}):
+            self.assertEqual(parse_cpus("auto"), [1, 2, 3])
+
+    def test_bad_value(self):
+        with self.assertRaises(ValueError):
+            parse_cpus("all")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+from unittest import mock
+
+from task_cache import LRUCache
+
+
+class LRUCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch("task_cache.time.monotonic", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache = LRUCache(max_size=2, ttl=30)
+
+    def test_put_then_get(self):
+        self.cache.put("a", 1, self.cache.version)
+        self.assertEqual(self.cache.get("a"), 1)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 0))
+
+    def test_stale_put_after_invalidate(self):
+        # A query started before a write must not cache its result after the write
+        version = self.cache.version
+        self.cache.invalidate("a")
+        self.cache.put("a", "old", version)
+        self.assertEqual(self.cache.get("a"), None)
+
+        self.cache.put("a", "new", self.cache.version)
+        self.assertEqual(self.cache.get("a"), "new")
+
+    def test_invalidate_of_other_key_skips_put(self):
+        version = self.cache.version
+        self.cache.invalidate("b")
+        self.cache.put("a", 1, version)
+        self.assertEqual(self.cache.get("a"), None)
+
+    def test_ttl_expiry(self):
+        self.cache.put("a", 1, self.cache.version)
+        self.now += 29
+        self.assertEqual(self.cache.get("a"), 1)
+        self.now += 2
+        self.assertEqual(self.cache.get("a"), None)
+        self.assertNotIn("a", self.cache.entries)
+
+    def test_evicts_least_recently_used(self):
+        self.cache.put("a", 1, self.cache.version)
+        self.cache.put("b", 2, self.cache.version)
+        # a becomes the most recently used, so b goes first
+        self.cache.get("a")
+        self.cache.put("c", 3, self.cache.version)
+        self.assertEqual((self.cache.get("a"), self.cache.get("b"), self.cache.get("c")), (1, None, 3))
+
+    def test_put_refreshes_order(self):
+        self.cache.put("a", 1, self.cache.version)
+        self.cache.put("b", 2, self.cache.version)
+        self.cache.put("a", 10, self.cache.version)
+        self.cache.put("c", 3, self.cache.version)
+        self.assertEqual((self.cache.get("a"), self.cache.get("b")), (10, None))
+
+    def test_stats(self):
+        self.cache.put("a", 1, self.cache.version)
+        self.cache.get("a")
+        self.cache.get("b")
+        self.assertEqual(self.cache.stats(), {"size": 1, "hits": 1, "misses": 1, "hit_rate": 0.5})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+from datetime import datetime, timedelta
+
+import pymongo
+from bson.objectid import ObjectId
+
+from mongo_api import Task, _page_query, _page_result
+
+DEADLINE = datetime(2026, 1, 2, 12, 0)
+
+
+def docs(count: int) -> list:
+    return [{"_id": ObjectId(), "user_id": 7, "title": f"task {i}", "deadline": DEADLINE + timedelta(days=i)}
+            for i in range(count)]
+
+
+class PageQueryTest(unittest.TestCase):
+    def test_first_page(self):
+        query, sort = _page_query(7, None, None)
+        self.assertEqual(query, {"user_id": 7})
+        self.assertEqual(sort, [("deadline", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)])
+
+    def test_after_continues_past_the_cursor(self):
+        task_id = ObjectId()
+        query, sort = _page_query(7, (DEADLINE, str(task_id)), None)
+        # Later deadline, or the same deadline and a later id
+        self.assertEqual(query, {"user_id": 7, "$or": [
+            {"deadline": {"$gt": DEADLINE}},
+            {"deadline": DEADLINE, "_id": {"$gt": task_id}},
+        ]})
+        self.assertEqual(sort, [("deadline", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)])
+
+    def test_before_walks_backwards(self):
+        task_id = ObjectId()
+        query, sort = _page_query(7, None, (DEADLINE, task_id))
+        self.assertEqual(query, {"user_id": 7, "$or": [
+            {"deadline": {"$lt": DEADLINE}},
+            {"deadline": DEADLINE, "_id": {"$lt": task_id}},
+        ]})
+        self.assertEqual(sort, [("deadline", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)])
+
+
+class PageResultTest(unittest.TestCase):
+    def test_first_page_with_more(self):
+        found = docs(4)
+        tasks, has_prev, has_next = _page_result(Task, list(found), None, None, 3)
+        self.assertEqual([task._id for task in tasks], [doc["_id"] for doc in found[:3]])
+        self.assertFalse(has_prev)
+        self.assertTrue(has_next)
+
+    def test_last_page_after_cursor(self):
+        found = docs(2)
+        tasks, has_prev, has_next = _page_result(Task, list(found), (DEADLINE, ObjectId()), None, 3)
+        self.assertEqual(len(tasks), 2)
+        self.assertTrue(has_prev)
+        self.assertFalse(has_next)
+
+    def test_before_is_put_back_in_deadline_order(self):
+        # Queried in descending order, one extra document means there is an earlier page
+        found = docs(4)[::-1]
+        tasks, has_prev, has_next = _page_result(Task, list(found), None, (DEADLINE, ObjectId()), 3)
+        self.assertEqual([task.deadline for task in tasks], sorted(doc["deadline"] for doc in found[:3]))
+        self.assertTrue(has_prev)
+        self.assertTrue(has_next)
+
+    def test_before_reaching_the_start(self):
+        found = docs(2)[::-1]
+        tasks, has_prev, has_next = _page_result(Task, list(found), None, (DEADLINE, ObjectId()), 3)
+        self.assertEqual([task.title for task in tasks], ["task 0", "task 1"])
+        self.assertFalse(has_prev)
+        self.assertTrue(has_next)
+
+    def test_projected_out_description(self):
+        tasks, _, _ = _page_result(Task, docs(1), None, None, 3)
+        self.assertIsNone(tasks[0].description)
+        self.assertFalse(tasks[0].was_longen)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,34 @@
+import asyncio
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, url: str, path: str, host: str, port: int, secret: str = None):
+    """Serves updates pushed by Telegram instead of polling for them.
+
+    Any number of these processes can sit behind a reverse proxy that forwards url to them.
+    Requests without the matching X-Telegram-Bot-Api-Secret-Token header are rejected."""
+    if secret == None:
+        # main.py only gets here with --webhook-insecure
+        print("webhook: WEBHOOK_SECRET is not set, anyone who finds the url can post updates")
+
+    if url:
+        # Every replica registers the same url, which is harmless
+        await bot.set_webhook(url.rstrip("/") + path, secret_token=secret)
+
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=secret).register(app, path=path)
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    print(f"webhook: listening on {host}:{port}{path}")
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()